@@ -1,17 +1,37 @@
 from django.contrib import admin
 
+from . import search
 from .models import Post, Group, Comment, Follow
+from .paginator import EstimatedCountPaginator
 
 
-class PostAdmin(admin.ModelAdmin):
+class ScalableAdmin(admin.ModelAdmin):
+    """Changelists of tables with millions of rows: one COUNT at most,
+    capped or estimated, see EstimatedCountPaginator."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class PostAdmin(ScalableAdmin):
     # Поля, которые должны отображаться в админке
     list_display = ("pk", "text", "pub_date", "author")
+    list_select_related = ("author",)
     # добавляем интерфейс для поиска по тексту постов
     search_fields = ("text",)
     # Добавляем возможность фильтрации по дате
     list_filter = ("pub_date",)
+    # Навигация по датам, ссылки от первой до последней даты,
+    # см. posts/templatetags/admin_dates.py
+    date_hierarchy = "pub_date"
+    autocomplete_fields = ("author", "group")
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index instead of LIKE '%term%' over every post
+        if not search_term:
+            return queryset, False
+        return queryset.filter(pk__in=search.search(search_term)), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ("title", "description", "slug")
@@ -20,15 +40,22 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableAdmin):
     list_display = ('post_id', 'author', 'text', 'created',)
-    search_fields = ('text', 'author',)
+    list_select_related = ('author',)
+    # Точное имя автора ищется по индексу username
+    search_fields = ('text', '=author__username',)
     list_filter = ('created',)
+    raw_id_fields = ('post',)
+    autocomplete_fields = ('author',)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(ScalableAdmin):
     list_display = ('author', 'user',)
-    list_filter = ('author', 'user')
+    list_select_related = ('author', 'user',)
+    # Вместо фильтров со списком всех пользователей
+    search_fields = ('=author__username', '=user__username',)
+    autocomplete_fields = ('author', 'user',)
 
 
 admin.site.register(Post, PostAdmin)
@@ -0,0 +1,210 @@
+"""Read-only JSON API over posts, groups, comments and follows.
+
+Rows are read with values() and serialized straight from the dicts, no
+model instances are built. Lists are cursor paginated like the HTML
+feeds: follow next_cursor with ?cursor=.
+
+Every response carries a strong ETag made from a version that every
+change replaces: the index generation of posts.feed_cache, or the follow
+feed version for /follow/ (see posts.conditional). There is no
+Last-Modified, edits and deletions leave the newest pub_date alone or
+move it back. A GET whose If-None-Match still matches is answered 304
+after at most an existence query, before any row is read.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+
+from posts import feed_cache, timeline
+from posts.conditional import conditional
+from posts.models import Comment, Group, Post, User, UserStats
+from posts.paginator import CursorPaginator
+
+POST_FIELDS = ('pk', 'text', 'pub_date', 'image', 'comment_count',
+               'author__username', 'group__slug')
+COMMENT_FIELDS = ('pk', 'text', 'created', 'author__username')
+PROFILE_FIELDS = ('pk', 'username', 'first_name', 'last_name',
+                  'stats__followers_count', 'stats__following_count',
+                  'stats__posts_count')
+
+
+def serialize_post(row):
+    return {
+        'id': row['pk'],
+        'text': row['text'],
+        'pub_date': row['pub_date'].isoformat(),
+        'author': row['author__username'],
+        'group': row['group__slug'],
+        'image': default_storage.url(row['image']) if row['image'] else None,
+        'comment_count': row['comment_count'],
+    }
+
+
+def serialize_comment(row):
+    return {
+        'id': row['pk'],
+        'author': row['author__username'],
+        'text': row['text'],
+        'created': row['created'].isoformat(),
+    }
+
+
+def not_found():
+    return JsonResponse({'detail': 'Не найдено'}, status=404)
+
+
+def get_page(request, queryset, fields, cursor_field='pub_date',
+             descending=True, pk_field='pk'):
+    paginator = CursorPaginator(queryset.values(*fields, cursor_field),
+                                settings.API_PAGE_SIZE,
+                                cursor_field=cursor_field,
+                                descending=descending, pk_field=pk_field)
+    return paginator.get_page(None, cursor=request.GET.get('cursor'))
+
+
+def page_response(page, serialize):
+    return JsonResponse({
+        'results': [serialize(row) for row in page],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    })
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.user.is_anonymous:
+            return JsonResponse({'detail': 'Нужна авторизация'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def post_list_validators(request):
+    return feed_cache.index_generation()
+
+
+@require_safe
+@conditional(post_list_validators)
+def post_list(request):
+    page = get_page(request, Post.objects.all(), POST_FIELDS)
+    return page_response(page, serialize_post)
+
+
+def group_post_list_validators(request, slug):
+    if not Group.objects.filter(slug=slug).exists():
+        return None
+    return feed_cache.index_generation()
+
+
+@require_safe
+@conditional(group_post_list_validators)
+def group_post_list(request, slug):
+    page = get_page(request, Post.objects.filter(group__slug=slug),
+                    POST_FIELDS)
+    # Only an empty page may be a missing group
+    if not page and not Group.objects.filter(slug=slug).exists():
+        return not_found()
+    return page_response(page, serialize_post)
+
+
+def profile_row(username):
+    return (User.objects.filter(username=username)
+            .values(*PROFILE_FIELDS).first())
+
+
+def profile_validators(request, username):
+    row = profile_row(username)
+    if row is None:
+        return None
+    # Follows change the counters but not the index generation
+    counters = (row['stats__followers_count'],
+                row['stats__following_count'], row['stats__posts_count'])
+    return f'{feed_cache.index_generation()}.{counters}'
+
+
+@require_safe
+@conditional(profile_validators)
+def profile(request, username):
+    row = profile_row(username)
+    if row is None:
+        return not_found()
+    if row['stats__posts_count'] is None:
+        stats = UserStats.for_user(User.objects.get(pk=row['pk']))
+        row.update(stats__followers_count=stats.followers_count,
+                   stats__following_count=stats.following_count,
+                   stats__posts_count=stats.posts_count)
+    return JsonResponse({
+        'id': row['pk'],
+        'username': row['username'],
+        'first_name': row['first_name'],
+        'last_name': row['last_name'],
+        'followers_count': row['stats__followers_count'],
+        'following_count': row['stats__following_count'],
+        'posts_count': row['stats__posts_count'],
+    })
+
+
+def profile_post_list_validators(request, username):
+    if not User.objects.filter(username=username).exists():
+        return None
+    return feed_cache.index_generation()
+
+
+@require_safe
+@conditional(profile_post_list_validators)
+def profile_post_list(request, username):
+    page = get_page(request, Post.objects.filter(author__username=username),
+                    POST_FIELDS)
+    if not page and not User.objects.filter(username=username).exists():
+        return not_found()
+    return page_response(page, serialize_post)
+
+
+def post_detail_validators(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return None
+    return feed_cache.index_generation()
+
+
+@require_safe
+@conditional(post_detail_validators)
+def post_detail(request, post_id):
+    row = Post.objects.filter(pk=post_id).values(*POST_FIELDS).first()
+    if row is None:
+        return not_found()
+    return JsonResponse(serialize_post(row))
+
+
+def comment_list_validators(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return None
+    return feed_cache.index_generation()
+
+
+@require_safe
+@conditional(comment_list_validators)
+def comment_list(request, post_id):
+    page = get_page(request, Comment.objects.filter(post_id=post_id),
+                    COMMENT_FIELDS, cursor_field='created', descending=False)
+    if not page and not Post.objects.filter(pk=post_id).exists():
+        return not_found()
+    return page_response(page, serialize_comment)
+
+
+def follow_feed_validators(request):
+    if request.user.is_anonymous:
+        return None
+    # The version tokens are per user, so are the ETags
+    return feed_cache.feed_version(request.user)
+
+
+@require_safe
+@api_login_required
+@conditional(follow_feed_validators)
+def follow_feed(request):
+    page = get_page(request, timeline.feed(request.user), POST_FIELDS,
+                    **timeline.FEED_ORDER)
+    return page_response(page, serialize_post)
@@ -0,0 +1,91 @@
+"""Read-through cache of the rows the views look up by natural key.
+
+user_cache, group_cache and post_cache keep User by username, Group by
+slug and Post by pk. A lookup that finds nothing is cached too, for a
+shorter time, so requests for missing pages don't all reach the
+database.
+
+posts.signals drops an entry when its row is saved or deleted, again
+when the transaction commits, so a concurrent reader can't put the old
+row back for long. Rows changed with update() or bulk_create() keep
+their entries until OBJECT_CACHE_TIMEOUT. The related objects of a
+cached row are not cached with it: users read from the database come
+with their stats, users read from the cache without. Users are read
+and cached with only the fields the pages show, never with their
+password hash, email or permissions.
+"""
+import copy
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+
+from posts.models import Group, Post, User
+
+# Cached in place of a row that does not exist
+MISSING = 'missing'
+
+
+class ObjectCache:
+    def __init__(self, model, field, select_related=(), only=()):
+        self.model = model
+        self.field = field
+        # Joined on a miss for the caller, never cached
+        self.select_related = select_related
+        # The fields read and cached, all of them when empty
+        self.only = only
+
+    def key(self, value):
+        # Usernames in URLs may hold anything but a slash
+        return (f'object:{self.model._meta.model_name}:{self.field}:'
+                f'{quote(str(value))}')
+
+    def get(self, value):
+        """The row with this field value, or None."""
+        key = self.key(value)
+        obj = cache.get(key)
+        if obj is None:
+            queryset = self.model.objects.filter(**{self.field: value})
+            if self.only:
+                queryset = queryset.only(*self.only)
+            obj = queryset.select_related(*self.select_related).first()
+            if obj is None:
+                cache.set(key, MISSING,
+                          settings.OBJECT_CACHE_MISSING_TIMEOUT)
+            else:
+                cache.set(key, self.bare(obj),
+                          settings.OBJECT_CACHE_TIMEOUT)
+        return None if obj == MISSING else obj
+
+    @staticmethod
+    def bare(obj):
+        """A copy of the row without its related objects."""
+        obj = copy.copy(obj)
+        obj._state = copy.copy(obj._state)
+        obj._state.fields_cache = {}
+        return obj
+
+    def known_missing(self, value):
+        """Whether a recent lookup found nothing, without a query."""
+        return cache.get(self.key(value)) == MISSING
+
+    def get_or_404(self, value):
+        obj = self.get(value)
+        if obj is None:
+            raise Http404(f'No {self.model._meta.object_name} matches '
+                          f'the given query.')
+        return obj
+
+    def invalidate(self, *values):
+        keys = [self.key(value) for value in values if value is not None]
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# Counters change too often to be cached, see UserStats
+user_cache = ObjectCache(User, 'username', select_related=('stats',),
+                         only=('id', 'username', 'first_name', 'last_name'))
+group_cache = ObjectCache(Group, 'slug')
+post_cache = ObjectCache(Post, 'pk')
@@ -0,0 +1,98 @@
+"""Conditional GET for the post pages and the JSON API.
+
+A view decorated with conditional(validators) first calls
+validators(request, **kwargs), which runs a cheap query or two and
+returns the version of what the view would show. The strong ETag hashes
+it with the full path, and a request whose If-None-Match still matches
+is answered 304 before the view runs. The version must change whenever
+the response would: the index uses the index generation of
+posts.feed_cache, replaced on every post, comment and group change, the
+group, profile and post pages the scoped generations of what they show
+(feed_cache.scoped_generation), the API the index generation or the
+follow feed version.
+
+A page built from an outdated fragment, served while another request
+rebuilds it (see posts.page_cache.mark_stale), does not match the
+version: it goes out without an ETag and is not kept by any cache.
+
+There is no Last-Modified: no date of the rows moves on every change
+(edits, comments and deletions leave the newest pub_date alone or move
+it back), so If-Modified-Since would get stale 304s.
+
+Pages also depend on who is looking: their ETags include the viewer,
+while their versions don't, so posts.page_cache can share one cached
+shell of a page between all viewers. page_cache_control lets shared
+caches keep the pages of anonymous users.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import (add_never_cache_headers, patch_cache_control,
+                                patch_vary_headers)
+from django.views.decorators.http import condition
+
+from posts.page_cache import served_stale
+
+
+def conditional(validators, per_viewer=False):
+    """Answer conditional GETs from validators(request, **kwargs).
+
+    validators returns the version, or None when the view would not
+    find what it shows. It is called once per request and its
+    result is kept in request._validators. With per_viewer the ETag also
+    depends on the viewer.
+    """
+    def cached(request, **kwargs):
+        if not hasattr(request, '_validators'):
+            request._validators = validators(request, **kwargs)
+        return request._validators
+
+    def etag(request, **kwargs):
+        version = cached(request, **kwargs)
+        if version is None:
+            return None
+        raw = f'{request.get_full_path()}|{version}'
+        if per_viewer:
+            raw += f'|{viewer(request)}'
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if served_stale(request) and response.has_header('ETag'):
+                del response['ETag']
+            return response
+        return wrapper
+    return decorator
+
+
+def viewer(request):
+    """The part of a page version that depends on the viewer."""
+    if request.user.is_anonymous:
+        return 'anonymous'
+    # The comment form carries a token made from the CSRF cookie
+    return f'{request.user.pk}:{request.META.get("CSRF_COOKIE", "")}'
+
+
+def page_cache_control(view):
+    """Pages of anonymous users are the same for all of them and may be
+    kept by a shared cache for PAGE_SHARED_MAX_AGE seconds; pages of
+    logged in users are private. Browsers always revalidate. Pages built
+    from an outdated fragment are not kept at all."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if served_stale(request):
+            add_never_cache_headers(response)
+        elif request.user.is_anonymous:
+            patch_cache_control(response, public=True, max_age=0,
+                                s_maxage=settings.PAGE_SHARED_MAX_AGE)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+    return wrapper
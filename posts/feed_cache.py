@@ -0,0 +1,149 @@
+"""Versioned fragment caches for the post feeds.
+
+index.html caches its pages under a global generation that is replaced
+whenever a post, comment or group changes; a stale fragment is still
+served while a single worker rebuilds it (see get_or_build). The group,
+profile and post pages are versioned by the scoped generations of what
+they show instead (see scoped_generation), so a change elsewhere leaves
+them alone.
+
+follow.html caches the feed under (user, page) for one version, rebuilt
+like the index fragments. The version is made of a token per user,
+dropped on follow/unfollow and whenever an author the user follows
+publishes, edits or deletes a post or gets a comment, plus a token per
+followed popular author (those are not fanned out, see posts.timeline).
+A dropped token is replaced by a fresh one on the next read, which
+outdates exactly the fragments built with it.
+
+Post cards (post_item.html) are cached one by one under a digest of
+everything the card shows (see card_key), so pages rebuilt after a
+change render only the cards that did change. The edit link its author
+sees is a hole, see posts.page_cache.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from posts import timeline
+
+USER_VERSION_KEY = 'follow_feed:user:{user_id}'
+AUTHOR_VERSION_KEY = 'follow_feed:author:{author_id}'
+INDEX_GENERATION_KEY = 'index:generation'
+SCOPE_GENERATION_KEY = 'generation:{scope}'
+CARD_KEY = 'post_card:{post_id}:{version}'
+# How long a worker may take to rebuild a fragment before others give up
+# waiting on it and rebuild too
+REBUILD_LOCK_TIMEOUT = 30
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def _version(keys):
+    """The tokens under keys joined, missing ones replaced by new ones."""
+    tokens = cache.get_many(keys)
+    missing = {key: _new_token() for key in keys if key not in tokens}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        tokens.update(missing)
+    return '.'.join(tokens[key] for key in keys)
+
+
+def feed_version(user):
+    """Version string of the user's follow feed fragments."""
+    keys = [USER_VERSION_KEY.format(user_id=user.pk)]
+    keys += [AUTHOR_VERSION_KEY.format(author_id=author_id)
+             for author_id in sorted(timeline.followed_celebrities(user))]
+    return _version(keys)
+
+
+def invalidate_user(user_id):
+    cache.delete(USER_VERSION_KEY.format(user_id=user_id))
+
+
+def invalidate_author(author_id):
+    """Invalidate the follow feeds showing this author's posts."""
+    user_ids = timeline.follower_ids(author_id)
+    if len(user_ids) > settings.TIMELINE_FANOUT_LIMIT:
+        cache.delete(AUTHOR_VERSION_KEY.format(author_id=author_id))
+        return
+    cache.delete_many([USER_VERSION_KEY.format(user_id=user_id)
+                       for user_id in user_ids])
+
+
+def index_generation():
+    generation = cache.get(INDEX_GENERATION_KEY)
+    if generation is None:
+        generation = _new_token()
+        if not cache.add(INDEX_GENERATION_KEY, generation, timeout=None):
+            generation = cache.get(INDEX_GENERATION_KEY, generation)
+    return generation
+
+
+def invalidate_index():
+    cache.set(INDEX_GENERATION_KEY, _new_token(), timeout=None)
+
+
+def post_scopes(post_id, author_id, group_id):
+    """Scopes of the pages showing a post: its own page, its author's
+    profile and its group."""
+    scopes = [f'post:{post_id}', f'author:{author_id}']
+    if group_id is not None:
+        scopes.append(f'group:{group_id}')
+    return scopes
+
+
+def scoped_generation(*scopes):
+    """Version string of a page showing these scopes, e.g. 'group:1'."""
+    return _version([SCOPE_GENERATION_KEY.format(scope=scope)
+                     for scope in scopes])
+
+
+def invalidate_scopes(*scopes):
+    cache.delete_many([SCOPE_GENERATION_KEY.format(scope=scope)
+                       for scope in scopes])
+
+
+def get_or_build(key, generation, timeout, build, on_stale=None):
+    """Return the value cached under key for this generation.
+
+    Values are stored along with their generation. When it is out of
+    date only the worker that takes the rebuild lock calls build(), the
+    others keep serving the stale value until it is replaced, after
+    calling on_stale().
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+    lock_key = f'{key}:rebuild'
+    if not cache.add(lock_key, generation, REBUILD_LOCK_TIMEOUT):
+        if entry is not None:
+            if on_stale is not None:
+                on_stale()
+            return entry[1]
+        # Nothing to serve yet, build without storing
+        return build()
+    try:
+        value = build()
+        cache.set(key, (generation, value), timeout)
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+def card_key(post):
+    """Cache key of a post card, changes whenever the card would.
+
+    The post must come with its author and group (select_related).
+    """
+    group = post.group
+    shown = (post.text, post.image.name if post.image else '',
+             post.thumbnails_ready, post.comment_count,
+             post.pub_date.isoformat(),
+             post.author.username,
+             group.slug if group else None, group.title if group else None)
+    version = hashlib.blake2b(repr(shown).encode(), digest_size=8)
+    return CARD_KEY.format(post_id=post.pk, version=version.hexdigest())
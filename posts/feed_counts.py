@@ -0,0 +1,95 @@
+"""Post totals of the feeds, used for the numbered page links.
+
+The index and group totals are kept in the cache and moved by
+posts.signals as posts are published, moved between groups and
+deleted. A missing total is counted again. With FEED_COUNT_ESTIMATE the
+index total is read from the database statistics instead, which is
+immediate on any table size but only as fresh as the last ANALYZE.
+
+Author totals are UserStats.posts_count. Follow feed totals are cached
+under the feed version, see posts.feed_cache.feed_version.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+
+from posts.models import Post, UserStats
+
+INDEX_COUNT_KEY = 'feed_count:index'
+GROUP_COUNT_KEY = 'feed_count:group:{group_id}'
+FOLLOW_COUNT_KEY = 'feed_count:follow:{user_id}:{version}'
+
+
+def estimated_count(model):
+    """Row count of the model's table from the planner statistics, None
+    when the database has none."""
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples FROM pg_class '
+                               'WHERE relname = %s', [table])
+            elif connection.vendor == 'sqlite':
+                # Filled by ANALYZE, the first number is the row count
+                cursor.execute('SELECT stat FROM sqlite_stat1 '
+                               'WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None:
+        return None
+    estimate = int(str(row[0]).split()[0].split('.')[0])
+    # PostgreSQL reports -1 for a table never analyzed
+    return estimate if estimate >= 0 else None
+
+
+def _cached(key, count):
+    total = cache.get(key)
+    if total is None:
+        total = count()
+        cache.add(key, total, settings.FEED_COUNT_TIMEOUT)
+    return total
+
+
+def index_count():
+    def count():
+        if settings.FEED_COUNT_ESTIMATE:
+            estimate = estimated_count(Post)
+            if estimate is not None:
+                return estimate
+        return Post.objects.count()
+    return _cached(INDEX_COUNT_KEY, count)
+
+
+def group_count(group):
+    return _cached(GROUP_COUNT_KEY.format(group_id=group.pk),
+                   group.group_posts.count)
+
+
+def author_count(author):
+    return UserStats.for_user(author).posts_count
+
+
+def follow_count(user, version, post_list):
+    """Total of the user's follow feed at this feed version."""
+    return _cached(FOLLOW_COUNT_KEY.format(user_id=user.pk, version=version),
+                   post_list.count)
+
+
+def _change(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Not cached, it is counted on the next read
+        pass
+
+
+def change_index(delta):
+    _change(INDEX_COUNT_KEY, delta)
+
+
+def change_group(group_id, delta):
+    if group_id is not None:
+        _change(GROUP_COUNT_KEY.format(group_id=group_id), delta)
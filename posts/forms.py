@@ -1,6 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
-from .models import Post, Comment
+from .models import Post, Comment, Group, User
+from .uploads import ImageTooLarge, InvalidImage, compact_image
 
 
 class PostForm(forms.ModelForm):
@@ -8,8 +10,40 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('group', 'text', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Only new uploads are processed, not the already stored file
+        if not isinstance(image, UploadedFile):
+            return image
+        field = self.fields['image']
+        try:
+            return compact_image(image)
+        except ImageTooLarge:
+            raise forms.ValidationError(
+                'Изображение слишком большое.', code='image_too_large')
+        except InvalidImage:
+            raise forms.ValidationError(
+                field.error_messages['invalid_image'], code='invalid_image')
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
         fields = ('text',)
+
+
+class SearchForm(forms.Form):
+    q = forms.CharField(label='Найти', max_length=200)
+    group = forms.ModelChoiceField(
+        Group.objects.all(), required=False, to_field_name='slug',
+        label='Группа', empty_label='Все группы')
+    author = forms.CharField(label='Автор', max_length=150, required=False)
+
+    def clean_author(self):
+        username = self.cleaned_data['author']
+        if not username:
+            return None
+        author = User.objects.filter(username=username).first()
+        if author is None:
+            raise forms.ValidationError('Нет такого автора.')
+        return author
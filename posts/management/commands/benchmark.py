@@ -0,0 +1,211 @@
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Comment, Follow, Group, Post, User
+
+NO_CACHE = {
+    alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    for alias in ('default', 'shared')
+}
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+def summary(timings, queries, errors, elapsed):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'mean_ms': sum(timings) / len(timings),
+        'max_ms': timings[-1],
+        'queries_mean': sum(queries) / len(queries),
+        'queries_max': max(queries),
+        'throughput_rps': len(timings) / elapsed,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Time the posts views through the test client and report '
+            'latency percentiles, queries per request and throughput')
+
+    views = ('index', 'group_posts', 'profile', 'post_view',
+             'follow_index', 'add_comment')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests timed per view',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Untimed requests per view made first',
+        )
+        parser.add_argument(
+            '--view', action='append', choices=self.views, dest='only',
+            help='Only time this view, may be repeated',
+        )
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Run with the dummy cache backend',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Save the results as JSON')
+        parser.add_argument(
+            '--compare', help='JSON of an earlier run to compare with',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.sample()
+        with ExitStack() as stack:
+            if options['no_cache']:
+                stack.enter_context(override_settings(CACHES=NO_CACHE))
+            results = {
+                view: self.run(view, options['requests'],
+                               options['warmup'])
+                for view in options['only'] or self.views
+            }
+        report = {
+            'revision': git_revision(),
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'cache': not options['no_cache'],
+            'rows': {model.__name__: model.objects.count()
+                     for model in (User, Group, Post, Follow, Comment)},
+            'results': results,
+        }
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)['results']
+        self.print_results(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты сохранены в {options["output"]}'))
+
+    def sample(self):
+        """Pick the rows the requests are made for.
+
+        Busy authors, groups and readers are picked more often, like
+        real traffic would.
+        """
+        self.authors = list(
+            User.objects.annotate(posts=Count('author_posts'))
+            .filter(posts__gt=0).order_by('-posts')
+            .values_list('username', flat=True)[:1000])
+        self.groups = list(
+            Group.objects.annotate(posts=Count('group_posts'))
+            .order_by('-posts').values_list('slug', flat=True)[:100])
+        self.posts = list(
+            Post.objects.order_by('-pub_date', '-pk')
+            .values_list('author__username', 'pk')[:1000])
+        readers = list(
+            User.objects.annotate(follows=Count('follower'))
+            .filter(follows__gt=0).order_by('-follows')[:20])
+        if not (self.authors and self.groups and self.posts and readers):
+            raise CommandError('Нет данных, сначала выполните seed_data')
+        self.clients = []
+        for reader in readers:
+            client = Client(SERVER_NAME='localhost')
+            client.force_login(reader)
+            self.clients.append(client)
+        self.anonymous = Client(SERVER_NAME='localhost')
+
+    def pick(self, items):
+        # Roughly a power law over items ordered by activity
+        return items[int(len(items) * self.random.random() ** 3)]
+
+    def request(self, view):
+        """(client, method, url, data) of one request to the view."""
+        if view == 'index':
+            return self.anonymous, 'get', reverse('index'), None
+        if view == 'group_posts':
+            url = reverse('group_posts',
+                          kwargs={'slug': self.pick(self.groups)})
+            return self.anonymous, 'get', url, None
+        if view == 'profile':
+            url = reverse('profile',
+                          kwargs={'username': self.pick(self.authors)})
+            return self.pick(self.clients), 'get', url, None
+        username, post_id = self.pick(self.posts)
+        kwargs = {'username': username, 'post_id': post_id}
+        if view == 'post_view':
+            return (self.pick(self.clients), 'get',
+                    reverse('post_view', kwargs=kwargs), None)
+        if view == 'follow_index':
+            return (self.pick(self.clients), 'get',
+                    reverse('follow_index'), None)
+        return (self.pick(self.clients), 'post',
+                reverse('add_comment', kwargs=kwargs),
+                {'text': 'benchmark comment'})
+
+    def run(self, view, count, warmup):
+        self.stdout.write(f'{view}...')
+        for _ in range(warmup):
+            client, method, url, data = self.request(view)
+            getattr(client, method)(url, data)
+        timings, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(count):
+            client, method, url, data = self.request(view)
+            with CaptureQueriesContext(connection) as context:
+                request_started = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                timings.append(
+                    (time.perf_counter() - request_started) * 1000)
+            queries.append(len(context))
+            if response.status_code >= 400:
+                errors += 1
+        return summary(timings, queries, errors,
+                       time.perf_counter() - started)
+
+    def print_results(self, results, baseline=None):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{"view":<14}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"queries":>9}{"req/s":>9}{"errors":>8}'))
+        for view, result in results.items():
+            line = (f'{view:<14}{result["p50_ms"]:>9.2f}'
+                    f'{result["p95_ms"]:>9.2f}{result["p99_ms"]:>9.2f}'
+                    f'{result["queries_mean"]:>9.1f}'
+                    f'{result["throughput_rps"]:>9.1f}'
+                    f'{result["errors"]:>8}')
+            before = (baseline or {}).get(view)
+            if before:
+                change = result['p50_ms'] / before['p50_ms'] * 100 - 100
+                line += (f'   p50 {change:+.0f}%, запросов было '
+                         f'{before["queries_mean"]:.1f}')
+            self.stdout.write(line)
@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+
+from posts import timeline
+from posts.models import Comment, Follow, Group, Post, User
+from posts.paginator import CursorPaginator
+
+
+class Command(BaseCommand):
+    help = ('Print the query plan and timing of every hot query of the '
+            'posts views on the current database')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Times each query is run to take the median',
+        )
+        parser.add_argument(
+            '--depth', type=int, default=10000,
+            help='Row offset used for the deep page queries',
+        )
+
+    def sample(self):
+        """Pick the busiest rows so the plans face the worst case."""
+        author = (User.objects.annotate(posts=Count('author_posts'))
+                  .order_by('-posts').first())
+        group = (Group.objects.annotate(posts=Count('group_posts'))
+                 .order_by('-posts').first())
+        follower = (User.objects.annotate(follows=Count('follower'))
+                    .order_by('-follows').first())
+        post = Post.objects.order_by('-comment_count').first()
+        if not all((author, group, follower, post)):
+            raise CommandError('Нужны данные: пользователи, группы, посты')
+        return author, group, follower, post
+
+    def queries(self, depth):
+        author, group, follower, post = self.sample()
+        deep = (Post.objects.order_by('-pub_date', '-pk')
+                .values_list('pub_date', 'pk')[depth:depth + 1])
+        deep = list(deep)
+
+        def first_page(queryset, **order):
+            return CursorPaginator(queryset, 10, **order).object_list[:11]
+
+        def after(queryset, row):
+            pub_date, pk = row
+            seek = Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+            return first_page(queryset.filter(seek))
+
+        yield 'index', first_page(Post.objects.all())
+        if deep:
+            yield 'index, deep cursor', after(Post.objects.all(), deep[0])
+            yield 'index, deep ?page=N', CursorPaginator(
+                Post.objects.all(), 10).object_list[depth:depth + 11]
+        yield 'group_posts', first_page(group.group_posts.all())
+        yield 'profile', first_page(author.author_posts.all())
+        yield 'follow_index', first_page(timeline.feed(follower),
+                                         **timeline.FEED_ORDER)
+        yield 'follow exists', Follow.objects.filter(user=follower,
+                                                     author=author)
+        yield 'followers of author', Follow.objects.filter(
+            author=author).values_list('user_id', flat=True)
+        yield 'post comments', Comment.objects.filter(
+            post=post).order_by('created', 'pk')[:50]
+
+    def handle(self, *args, **options):
+        for name, queryset in self.queries(options['depth']):
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{name}: {statistics.median(timings):.2f} ms'))
+            self.stdout.write(queryset.explain())
+            self.stdout.write('')
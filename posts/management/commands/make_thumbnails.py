@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts.models import Post
+from posts.thumbnails import PregeneratingBackend, image_ready, variants
+
+
+def _make_variants(name):
+    try:
+        backend = PregeneratingBackend()
+        for geometry_string, options in variants():
+            backend.generate(name, geometry_string, **options)
+        image_ready(name)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Make the missing image variants of existing posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of images processed in parallel',
+        )
+
+    def handle(self, *args, **options):
+        names = (Post.objects.exclude(image='').exclude(image__isnull=True)
+                 .values_list('image', flat=True).distinct().iterator())
+        done = failed = 0
+        # Pillow releases the GIL while decoding and resizing, so threads
+        # are enough to keep every core busy
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for name, future in [(name, executor.submit(_make_variants, name))
+                                 for name in names]:
+                try:
+                    future.result()
+                    done += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {done}, с ошибками: {failed}'))
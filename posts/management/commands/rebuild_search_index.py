@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Refill the full-text search index of posts and comments'
+
+    def handle(self, *args, **options):
+        indexed = search.backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано текстов: {indexed}'))
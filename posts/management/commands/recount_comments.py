@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute Post.comment_count from the Comment table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report how many posts have a wrong counter',
+        )
+
+    def handle(self, *args, **options):
+        counts = (Comment.objects.filter(post=OuterRef('pk'))
+                  .values('post').annotate(total=Count('pk'))
+                  .values('total'))
+        # One UPDATE ... SET comment_count = (SELECT COUNT(*) ...) for
+        # every post whose counter drifted
+        wrong = Post.objects.exclude(
+            comment_count=Coalesce(Subquery(counts), 0))
+        if options['dry_run']:
+            self.stdout.write(f'Неверных счётчиков: {wrong.count()}')
+            return
+        fixed = Post.objects.filter(pk__in=wrong.values('pk')).update(
+            comment_count=Coalesce(Subquery(counts), 0))
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков: {fixed}'))
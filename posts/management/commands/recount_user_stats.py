@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Follow, Post, User, UserStats
+
+
+def counter(queryset, field):
+    """SELECT COUNT(*) of queryset rows pointing to the outer user."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('user')})
+        .values(field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the follower, following and post counters of users'
+
+    def handle(self, *args, **options):
+        missing = (User.objects.filter(stats__isnull=True)
+                   .values_list('pk', flat=True).iterator())
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=pk) for pk in missing], batch_size=500)
+        updated = UserStats.objects.update(
+            followers_count=counter(Follow.objects, 'author'),
+            following_count=counter(Follow.objects, 'user'),
+            posts_count=counter(Post.objects, 'author'),
+        )
+        # Never cleared, see posts.timeline
+        UserStats.objects.filter(
+            followers_count__gt=settings.TIMELINE_FANOUT_LIMIT,
+        ).update(fan_out_on_read=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано пользователей: {updated}'))
@@ -0,0 +1,259 @@
+import bisect
+import itertools
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry,
+                          User)
+
+WORDS = (
+    'день ночь город дом улица река море лес поле небо солнце дождь снег '
+    'ветер утро вечер книга письмо дорога друг время жизнь работа мысль '
+    'вопрос ответ история память надежда радость песня музыка окно сад '
+    'новый старый тихий долгий светлый тёмный добрый странный последний '
+    'идти видеть знать думать писать читать помнить ждать любить жить'
+).split()
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей', 'Елена',
+               'Алексей', 'Наталья', 'Дмитрий')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов',
+              'Лебедев', 'Козлов', 'Новиков', 'Морозов', 'Волков')
+
+
+def zipf_weights(count, exponent):
+    """Cumulative weights of a power law over count ranks."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Let bulk_create store the given auto_now_add values as they are."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a large random but reproducible data '
+            'set: users, groups, posts, a power-law follow graph and '
+            'comments')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Mean number of authors each user follows',
+        )
+        parser.add_argument('--comments', type=int, default=1000000)
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Posts are spread over this many last days',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='Prefix of the generated usernames and group slugs',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+
+        user_ids = self.make_users(options['users'])
+        group_ids = self.make_groups(options['groups'])
+        # The same users are the most followed and the most prolific
+        self.random.shuffle(user_ids)
+        popularity = zipf_weights(len(user_ids), 1.1)
+        post_ids, started = self.make_posts(
+            options['posts'], options['days'], user_ids, popularity,
+            group_ids)
+        followers = self.make_follows(options['follows'], user_ids,
+                                      popularity)
+        self.make_comments(options['comments'], post_ids, started,
+                           options['days'], user_ids)
+        self.fill_timelines(user_ids, followers)
+
+        # bulk_create sends no signals: rebuild what they maintain
+        call_command('recount_user_stats', stdout=self.stdout)
+        call_command('recount_comments', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, групп: '
+            f'{len(group_ids)}, записей: {len(post_ids)}'))
+
+    def progress(self, message):
+        self.stdout.write(message)
+        self.stdout.flush()
+
+    def insert(self, model, objects):
+        """bulk_create in batches, the SQL is split further if needed."""
+        total = 0
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+            total += len(batch)
+        return total
+
+    def new_ids(self, model, last_pk):
+        return array('q', model.objects.filter(pk__gt=last_pk)
+                     .order_by('pk').values_list('pk', flat=True)
+                     .iterator())
+
+    def last_pk(self, model):
+        last = model.objects.order_by('-pk').values_list('pk', flat=True)
+        return last.first() or 0
+
+    def text(self, mean_words):
+        count = max(1, int(self.random.expovariate(1 / mean_words)))
+        return ' '.join(self.random.choices(WORDS, k=count)).capitalize()
+
+    def make_users(self, count):
+        self.progress(f'Пользователи: {count}')
+        # Hashing is slow on purpose, every user gets the same password
+        password = make_password('password')
+        last_pk = self.last_pk(User)
+        self.insert(User, (
+            User(username=f'{self.prefix}{number}', password=password,
+                 first_name=self.random.choice(FIRST_NAMES),
+                 last_name=self.random.choice(LAST_NAMES))
+            for number in range(count)
+        ))
+        return list(self.new_ids(User, last_pk))
+
+    def make_groups(self, count):
+        self.progress(f'Группы: {count}')
+        last_pk = self.last_pk(Group)
+        self.insert(Group, (
+            Group(title=f'{self.prefix} group {number}',
+                  slug=f'{self.prefix}-group-{number}',
+                  description=self.text(20))
+            for number in range(count)
+        ))
+        return list(self.new_ids(Group, last_pk))
+
+    def make_posts(self, count, days, user_ids, popularity, group_ids):
+        self.progress(f'Записи: {count}')
+        started = timezone.now() - timedelta(days=days)
+        step = timedelta(days=days) / max(count, 1)
+        group_weights = zipf_weights(len(group_ids), 1.0)
+
+        def posts():
+            for number in range(count):
+                group_id = None
+                # Most posts are in a group, bigger groups get more
+                if group_ids and self.random.random() < 0.7:
+                    group_id = self.random.choices(
+                        group_ids, cum_weights=group_weights)[0]
+                yield Post(
+                    text=self.text(40),
+                    author_id=self.random.choices(
+                        user_ids, cum_weights=popularity)[0],
+                    group_id=group_id,
+                    pub_date=started + step * number,
+                )
+
+        last_pk = self.last_pk(Post)
+        with explicit_dates(Post._meta.get_field('pub_date')):
+            self.insert(Post, posts())
+        return self.new_ids(Post, last_pk), started
+
+    def make_follows(self, mean, user_ids, popularity):
+        """Follow authors picked by popularity, returns follower counts."""
+        self.progress(f'Подписки: в среднем {mean} на пользователя')
+        followers = dict.fromkeys(user_ids, 0)
+        limit = len(user_ids) - 1
+
+        def follows():
+            for user_id in user_ids:
+                # Heavy tailed: most users follow a few authors, some follow
+                # very many
+                count = min(limit, mean * 50, int(
+                    self.random.paretovariate(1.5) * mean / 3))
+                authors = set()
+                while len(authors) < count:
+                    author_id = self.random.choices(
+                        user_ids, cum_weights=popularity)[0]
+                    if author_id != user_id:
+                        authors.add(author_id)
+                for author_id in authors:
+                    followers[author_id] += 1
+                    yield Follow(user_id=user_id, author_id=author_id)
+
+        total = self.insert(Follow, follows())
+        self.progress(f'Подписок создано: {total}')
+        return followers
+
+    def make_comments(self, count, post_ids, started, days, user_ids):
+        self.progress(f'Комментарии: {count}')
+        if not post_ids:
+            return
+        span = timedelta(days=days)
+        # Recent posts collect most of the comments
+        recency = zipf_weights(len(post_ids), 0.8)
+
+        def comments():
+            for _ in range(count):
+                rank = bisect.bisect_left(
+                    recency, self.random.random() * recency[-1])
+                index = len(post_ids) - 1 - rank
+                pub_date = started + span * (index / len(post_ids))
+                yield Comment(
+                    post_id=post_ids[index],
+                    author_id=self.random.choice(user_ids),
+                    text=self.text(12),
+                    created=pub_date + (timezone.now() - pub_date)
+                    * self.random.random() ** 4,
+                )
+
+        with explicit_dates(Comment._meta.get_field('created')):
+            self.insert(Comment, comments())
+
+    def fill_timelines(self, user_ids, followers):
+        """What fan-out-on-write would have stored, see posts.timeline."""
+        self.progress('Ленты подписок')
+        celebrities = [author_id for author_id, total in followers.items()
+                       if total > settings.TIMELINE_FANOUT_LIMIT]
+
+        def entries():
+            for number, user_id in enumerate(user_ids, 1):
+                followed = (Follow.objects.filter(user_id=user_id)
+                            .exclude(author__in=celebrities)
+                            .values('author'))
+                posts = (Post.objects.filter(author__in=followed)
+                         .order_by('-pub_date', '-pk')
+                         .values_list('pk', 'pub_date')
+                         [:settings.TIMELINE_SIZE])
+                for post_id, pub_date in posts:
+                    yield TimelineEntry(user_id=user_id, post_id=post_id,
+                                        pub_date=pub_date)
+                if number % 10000 == 0:
+                    self.progress(f'  {number} из {len(user_ids)}')
+
+        total = self.insert(TimelineEntry, entries())
+        self.progress(f'Записей в лентах: {total}')
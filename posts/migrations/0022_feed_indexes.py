@@ -0,0 +1,71 @@
+# Generated by Django 2.2.6 on 2026-10-18 18:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    keep = (Follow.objects.values('user', 'author')
+            .annotate(first=Min('pk')).values('first'))
+    deleted, _ = Follow.objects.exclude(pk__in=keep).delete()
+    if not deleted:
+        return
+
+    def counter(field):
+        return Coalesce(Subquery(
+            Follow.objects.filter(**{field: OuterRef('user')})
+            .values(field).annotate(total=Count('pk')).values('total')
+        ), 0)
+
+    UserStats.objects.update(followers_count=counter('author'),
+                             following_count=counter('user'))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('posts', '0021_userstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_follows,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='pub_date',
+            field=models.DateTimeField(auto_now_add=True,
+                                       verbose_name='date published'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created', 'id'],
+                               name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['author', 'user'],
+                               name='follow_author_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-pub_date', '-id'],
+                               name='post_pub_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date', '-id'],
+                               name='post_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date', '-id'],
+                               name='post_group_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'),
+                                               name='unique_follow'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:02
+
+from django.conf import settings
+from django.db import migrations
+
+
+def fts5_available(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+def postgres_vector():
+    return (f"to_tsvector('{settings.SEARCH_POSTGRES_CONFIG}'::regconfig, "
+            f"text)")
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite' and fts5_available(schema_editor):
+        tokenizer = "tokenize = 'unicode61 remove_diacritics 1'"
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE posts_post_fts USING fts5 '
+            f'(text, {tokenizer})')
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE posts_comment_fts USING fts5 '
+            f'(text, post_id UNINDEXED, {tokenizer})')
+        schema_editor.execute(
+            'INSERT INTO posts_post_fts (rowid, text) '
+            'SELECT id, text FROM posts_post')
+        schema_editor.execute(
+            'INSERT INTO posts_comment_fts (rowid, text, post_id) '
+            'SELECT id, text, post_id FROM posts_comment '
+            'WHERE post_id IS NOT NULL')
+    elif vendor == 'postgresql':
+        for table in ('posts_post', 'posts_comment'):
+            schema_editor.execute(
+                f'CREATE INDEX {table}_text_search ON {table} '
+                f'USING gin ({postgres_vector()})')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+        schema_editor.execute('DROP TABLE IF EXISTS posts_comment_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS posts_post_text_search')
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS posts_comment_text_search')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('posts', '0022_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-18 19:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_fan_out_on_read(apps, schema_editor):
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.filter(
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT,
+    ).update(fan_out_on_read=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('posts', '0023_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='fan_out_on_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_fan_out_on_read,
+                             migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='timelineentry',
+            name='timeline_user_pub_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'],
+                               name='timeline_user_pub_date_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import F
 
 User = get_user_model()
 
@@ -15,20 +17,49 @@ class Group(models.Model):
 
 class Post(models.Model):
     text = models.TextField()
-    pub_date = models.DateTimeField('date published', auto_now_add=True,
-                                    db_index=True)
+    pub_date = models.DateTimeField('date published', auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='author_posts')
     group = models.ForeignKey(Group, on_delete=models.SET_NULL,
                               null=True, blank=True, verbose_name='Group',
                               related_name='group_posts')
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    # Indexed for posts.thumbnails, which finds the posts of an image
+    image = models.ImageField(upload_to='posts/', blank=True, null=True,
+                              db_index=True)
+    # Maintained by posts.signals, see recount_comments to repair
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Set by posts.thumbnails once every variant of the image is stored
+    thumbnails_ready = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        # Feeds seek on (pub_date, id), optionally within an author or group
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text
 
-    def comment_count(self):
-        return Comment.objects.filter(post=self).count()
+    def save(self, *args, **kwargs):
+        # Never write back a possibly stale in-memory comment_count or
+        # thumbnails_ready over the value kept by update()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ('comment_count', 'thumbnails_ready')
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def change_comment_count(cls, post_id, delta):
+        cls.objects.filter(pk=post_id).update(
+            comment_count=F('comment_count') + delta)
 
 
 class Comment(models.Model):
@@ -40,9 +71,89 @@ class Comment(models.Model):
     text = models.TextField()
     created = models.DateTimeField('date published', auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+        ]
+
 
 class Follow(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='following')
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='follower')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+        ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """A post pushed into a follower's materialized follow feed.
+
+    pub_date is copied from the post so a timeline page can be read from
+    the (user, pub_date, post) index alone.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """Follower, following and post counters of a user.
+
+    Maintained by posts.signals, see recount_user_stats to repair.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='stats')
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
+    # Set for good once followers_count passes TIMELINE_FANOUT_LIMIT, see
+    # posts.timeline
+    fan_out_on_read = models.BooleanField(default=False)
+
+    @classmethod
+    def counted(cls, user_id):
+        """Stats computed from scratch, not saved."""
+        followers_count = Follow.objects.filter(author_id=user_id).count()
+        return cls(
+            user_id=user_id,
+            followers_count=followers_count,
+            following_count=Follow.objects.filter(user_id=user_id).count(),
+            posts_count=Post.objects.filter(author_id=user_id).count(),
+            fan_out_on_read=(followers_count
+                             > settings.TIMELINE_FANOUT_LIMIT),
+        )
+
+    @classmethod
+    def for_user(cls, user):
+        """The user's stats, created if the user has none yet."""
+        try:
+            return user.stats
+        except cls.DoesNotExist:
+            stats = cls.counted(user.pk)
+            stats.save()
+            return stats
+
+    @classmethod
+    def change(cls, user_id, **deltas):
+        # A user without stats gets them counted by for_user later
+        cls.objects.filter(user_id=user_id).update(
+            **{field: F(field) + delta for field, delta in deltas.items()})
@@ -0,0 +1,208 @@
+"""Whole page cache with holes for what depends on the viewer.
+
+The pages decorated with full_page_cache are rendered as shells: every
+fragment that depends on the viewer (nav bar, menu tabs, edit links,
+follow button, comment form) is left out by the {% hole %} tag, which
+writes a marker in its place. The shell is cached under the validators
+of posts.conditional, so a change to anything the page shows makes a
+new key and the old shell is never read again. Pages built from an
+outdated fragment (see mark_stale) are not cached under the new key.
+Cached shells are shared by anonymous and logged in users alike.
+
+PageHolesMiddleware fills the holes of every HTML response with the
+fragments rendered for the current request, usually without a query.
+Post cards are always rendered with holes, see the post_cards tag.
+
+Markers carry a random nonce made once per response (see hole_nonce),
+fill() leaves alone any marker without it, so text sent by users can't
+pass for one. What is cached with markers in it is cached along with
+their nonce and rebound to the nonce of the response that reads it
+(see adopt).
+"""
+import hashlib
+import json
+import re
+import secrets
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.context_processors import csrf
+from django.template.loader import get_template
+
+from posts.forms import CommentForm
+from posts.models import Follow
+
+PAGE_KEY = 'page:{digest}'
+MARKER = '\x00{nonce}:{payload}\x00'
+MARKER_RE = re.compile(b'\x00([0-9a-f]{16}):([^\x00]*)\x00')
+
+
+class Hole:
+    """A fragment rendered per viewer from template_name.
+
+    The template gets the values given to the {% hole %} tag, the user
+    and what extra_context(request, **values) returns.
+    """
+
+    def __init__(self, template_name, extra_context=None):
+        self.template_name = template_name
+        self.extra_context = extra_context
+
+    def context(self, request, values):
+        context = {'user': request.user, 'request': request,
+                   **csrf(request), **values}
+        if self.extra_context is not None:
+            context.update(self.extra_context(request, **values))
+        return context
+
+    def render(self, request, values):
+        return get_template(self.template_name).render(
+            self.context(request, values))
+
+
+def following(request, username):
+    is_following = (
+        not request.user.is_anonymous
+        and request.user.username != username
+        and Follow.objects.filter(user=request.user,
+                                  author__username=username).exists())
+    return {'following': is_following}
+
+
+def active_tab(request, active=None):
+    return {active: True} if active else {}
+
+
+def comment_form(request, **values):
+    return {'form': CommentForm()}
+
+
+HOLES = {
+    'nav': Hole('nav.html'),
+    'menu': Hole('menu.html', active_tab),
+    'post_edit_link': Hole('post_edit_link.html'),
+    'follow_button': Hole('follow_button.html', following),
+    'comment_form': Hole('comment_form.html', comment_form),
+}
+
+
+def hole_nonce(request):
+    """The nonce of the markers of this response."""
+    nonce = getattr(request, '_hole_nonce', None)
+    if nonce is None:
+        nonce = request._hole_nonce = secrets.token_hex(8)
+    return nonce
+
+
+def marker(request, name, values):
+    return MARKER.format(nonce=hole_nonce(request),
+                         payload=json.dumps([name, values]))
+
+
+def detach(request, content):
+    """(nonce, content) to cache content rendered for this response."""
+    return getattr(request, '_hole_nonce', None), content
+
+
+def adopt(request, nonce, content):
+    """Cached content with its markers rebound to this response."""
+    own = getattr(request, '_hole_nonce', None)
+    if nonce is None or nonce == own:
+        return content
+    if own is None:
+        # No marker written yet, this response takes the cached nonce
+        request._hole_nonce = nonce
+        return content
+    old, new = f'\x00{nonce}:', f'\x00{own}:'
+    if isinstance(content, bytes):
+        old, new = old.encode(), new.encode()
+    return content.replace(old, new)
+
+
+def mark_stale(request):
+    """Note that the response shows an outdated fragment, one served
+    while another request rebuilds it. Its page is not cached."""
+    if request is not None:
+        request._served_stale = True
+
+
+def served_stale(request):
+    return getattr(request, '_served_stale', False)
+
+
+def fill(content, request):
+    """Replace the hole markers in content (bytes) by their fragments.
+
+    Markers of another response, unknown holes and payloads that don't
+    decode are left as they are.
+    """
+    nonce = getattr(request, '_hole_nonce', None)
+    if nonce is None:
+        return content
+
+    def fragment(match):
+        if match.group(1).decode() != nonce:
+            return match.group(0)
+        try:
+            name, values = json.loads(match.group(2))
+            hole = HOLES[name]
+        except (ValueError, TypeError, KeyError):
+            return match.group(0)
+        if not isinstance(values, dict):
+            return match.group(0)
+        return hole.render(request, values).encode()
+    return MARKER_RE.sub(fragment, content)
+
+
+def full_page_cache(view):
+    """Serve the page from a cached shell when its validators match.
+
+    Must be applied under posts.conditional.conditional, whose
+    validators (request._validators) key the shell.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        validators = getattr(request, '_validators', None)
+        if request.method not in ('GET', 'HEAD') or validators is None:
+            return view(request, *args, **kwargs)
+        raw = repr((request.get_full_path(), validators))
+        digest = hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+        key = PAGE_KEY.format(digest=digest)
+        shell = cache.get(key)
+        if shell is not None:
+            return HttpResponse(adopt(request, *shell))
+        request.page_shell = True
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            request.page_shell = False
+        if (response.status_code == 200 and not response.streaming
+                and not served_stale(request)):
+            cache.set(key, detach(request, response.content),
+                      settings.PAGE_CACHE_TIMEOUT)
+        return response
+    return wrapper
+
+
+class PageHolesMiddleware:
+    """Fill the holes of HTML responses for the current request.
+
+    Goes after CsrfViewMiddleware, the comment form may need a token.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (response.streaming
+                or not response.get('Content-Type', '').startswith(
+                    'text/html')
+                or b'\x00' not in response.content):
+            return response
+        response.content = fill(response.content, request)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+        return response
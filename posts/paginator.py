@@ -0,0 +1,248 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.paginator import (EmptyPage, InvalidPage,
+                                   PageNotAnInteger, Page, Paginator)
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from posts.feed_counts import estimated_count
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def encode_cursor(direction, value, pk):
+    """Pack a seek position into an opaque url-safe token."""
+    raw = f'{direction}|{value.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Unpack a token made by encode_cursor into (direction, value, pk)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        direction, value, pk = raw.split('|')
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidCursor('Неверный курсор')
+    if direction not in (NEXT, PREVIOUS) or value is None:
+        raise InvalidCursor('Неверный курсор')
+    return direction, value, pk
+
+
+class CursorPage(Page):
+    """A page that knows the cursors of its neighbours.
+
+    ``number`` is only known when the page was requested by ?page=N,
+    cursor pages are anonymous and have ``number = None``.
+    """
+
+    def __init__(self, object_list, number, paginator, cursor=None,
+                 next_cursor=None, previous_cursor=None):
+        super().__init__(object_list, number, paginator)
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        if self.number is None:
+            return '<Page (cursor)>'
+        return super().__repr__()
+
+    @property
+    def cache_key(self):
+        # Used as a fragment cache key, unique for every distinct page
+        return self.cursor or str(self.number)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def page_window(self):
+        """Numbers of the pages linked from this one, see
+        CursorPaginator.get_elided_page_range. Empty for cursor pages."""
+        if self.number is None:
+            return []
+        return list(self.paginator.get_elided_page_range(self.number))
+
+
+class CursorPaginator(Paginator):
+    """Keyset paginator ordered by (cursor_field, pk).
+
+    Newest first by default, oldest first with ``descending=False``.
+    Pages are fetched with a WHERE on the last seen row instead of
+    OFFSET, and no COUNT(*) is run unless ``count`` is asked for.
+    ?page=N is still served with a single OFFSET query so old links work.
+    Rows may be model instances or values() dicts with a 'pk' key.
+
+    The total, only needed for numbered page links, may be given as a
+    number or a callable (see posts.feed_counts) to avoid the COUNT(*).
+    Ties are broken on pk_field, a copy of pk that may come from a
+    better indexed table (see posts.timeline.feed).
+    """
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, cursor_field='pub_date',
+                 descending=True, count=None, pk_field='pk', **kwargs):
+        self.cursor_field = cursor_field
+        self.pk_field = pk_field
+        self._count = count
+        # Lookups of the rows after and before a position
+        if descending:
+            self._after, self._before, sign = 'lt', 'gt', '-'
+        else:
+            self._after, self._before, sign = 'gt', 'lt', ''
+        object_list = object_list.order_by(f'{sign}{cursor_field}',
+                                           f'{sign}{pk_field}')
+        super().__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self._count is None:
+            return self.object_list.count()
+        if callable(self._count):
+            return self._count()
+        return self._count
+
+    def get_elided_page_range(self, number, on_each_side=2, on_ends=1):
+        """Page numbers around the given one and at both ends, with
+        ELLIPSIS for the gaps, like the paginator of newer Django."""
+        number = self.validate_number(number)
+        # An estimated count may be short of the page actually shown
+        num_pages = max(self.num_pages, number)
+        if num_pages <= (on_each_side + on_ends) * 2:
+            yield from range(1, num_pages + 1)
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(number + 1, num_pages + 1)
+
+    def validate_number(self, number):
+        # Unlike Paginator, don't look at num_pages: it costs a COUNT(*)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы не является целым числом')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+        return number
+
+    def get_page(self, number, cursor=None):
+        if cursor:
+            try:
+                return self.page_from_cursor(cursor)
+            except InvalidCursor:
+                pass
+        try:
+            return super().get_page(number)
+        except EmptyPage:
+            # ?page=N past the end: fall back to the last page like
+            # Paginator.get_page does
+            try:
+                return self.page(self.num_pages)
+            except EmptyPage:
+                # The cached or estimated count is ahead of the rows
+                return self.page(1)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('На этой странице нет результатов')
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return self._make_page(rows, number, None, has_next, number > 1)
+
+    def page_from_cursor(self, cursor):
+        direction, value, pk = decode_cursor(cursor)
+        field = self.cursor_field
+        if direction == NEXT:
+            seek = (Q(**{f'{field}__{self._after}': value})
+                    | Q(**{field: value,
+                           f'{self.pk_field}__{self._after}': pk}))
+            rows = list(self.object_list.filter(seek)[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            return self._make_page(rows, None, cursor, has_next, True)
+
+        seek = (Q(**{f'{field}__{self._before}': value})
+                | Q(**{field: value,
+                       f'{self.pk_field}__{self._before}': pk}))
+        rows = list(self.object_list.filter(seek).reverse()
+                    [:self.per_page + 1])
+        if len(rows) <= self.per_page:
+            # Nothing before this page: show the head of the feed instead
+            # of a short page
+            return self.page(1)
+        rows = rows[:self.per_page][::-1]
+        return self._make_page(rows, None, cursor, True, True)
+
+    def _make_page(self, rows, number, cursor, has_next, has_previous):
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self._cursor_for(NEXT, rows[-1])
+        if rows and has_previous:
+            previous_cursor = self._cursor_for(PREVIOUS, rows[0])
+        return CursorPage(rows, number, self, cursor=cursor,
+                          next_cursor=next_cursor,
+                          previous_cursor=previous_cursor)
+
+    def _cursor_for(self, direction, obj):
+        if isinstance(obj, dict):
+            # A values() row, which must include the cursor field and pk
+            return encode_cursor(direction, obj[self.cursor_field],
+                                 obj['pk'])
+        return encode_cursor(direction, getattr(obj, self.cursor_field),
+                             obj.pk)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator of the admin changelists, which must not COUNT(*) a
+    table of millions of rows on every page.
+
+    The total of a whole table is read from the database statistics once
+    they report more than ADMIN_EXACT_COUNT_LIMIT rows. Without them (a
+    SQLite database never analyzed) it is taken from MAX(pk) once the
+    count reaches the limit. Any other total is counted up to that limit
+    only, so the pages of a filter matching more rows stop there: narrow
+    the filter to reach the rest.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        whole_table = not self.object_list.query.where
+        if whole_table:
+            estimate = estimated_count(self.object_list.model)
+            if estimate is not None and estimate > limit:
+                return estimate
+        count = self.object_list[:limit].count()
+        if whole_table and count == limit:
+            # Read from the primary key index, deleted rows make it high
+            top = self.object_list.order_by().aggregate(top=Max('pk'))['top']
+            return max(count, top or 0)
+        return count
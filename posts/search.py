@@ -0,0 +1,246 @@
+"""Full-text search over post and comment text.
+
+On SQLite the text is copied into two FTS5 tables (posts_post_fts keyed
+by post id, posts_comment_fts keyed by comment id), kept in sync by
+posts.signals and ranked with bm25. On PostgreSQL the tables are not
+needed: GIN indexes on to_tsvector(text) are searched directly and
+ranked with ts_rank. Other databases fall back to LIKE scans. Both the
+FTS tables and the GIN indexes are created by migration 0023; see
+rebuild_search_index to refill the FTS tables.
+
+A post matches if its text or one of its comments contains every word
+of the query (as a prefix, there is no stemming on SQLite). Matches in
+comments rank lower, see SEARCH_COMMENT_WEIGHT.
+"""
+import abc
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from posts.models import Comment, Post
+
+MAX_TERMS = 10
+
+
+def terms(query):
+    """The words of a search query, anything else is dropped."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+class LikeBackend:
+    """Unranked LIKE '%term%' scans, newest posts first."""
+
+    def search(self, words, group_id, author_id, limit):
+        text_matches = Q()
+        comment_matches = Q()
+        for word in words:
+            text_matches &= Q(text__icontains=word)
+            comment_matches &= Q(text__icontains=word)
+        posts = Post.objects.filter(
+            text_matches
+            | Q(pk__in=Comment.objects.filter(comment_matches)
+                .values('post')))
+        if group_id is not None:
+            posts = posts.filter(group_id=group_id)
+        if author_id is not None:
+            posts = posts.filter(author_id=author_id)
+        return list(posts.order_by('-pub_date', '-pk')
+                    .values_list('pk', flat=True)[:limit])
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_comment(self, comment):
+        pass
+
+    def remove_comment(self, comment_id):
+        pass
+
+    def remove_post_comments(self, post_id):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+class RankedBackend(LikeBackend, metaclass=abc.ABCMeta):
+    """Posts ranked by the best of their text and comment matches."""
+
+    @abc.abstractmethod
+    def post_hits(self, words):
+        """SQL and params of (post_id, score) of the matching posts.
+
+        The lower the score the better the match.
+        """
+
+    @abc.abstractmethod
+    def comment_hits(self, words):
+        """Same as post_hits, for the posts of the matching comments."""
+
+    def search(self, words, group_id, author_id, limit):
+        filters, filter_params = '', []
+        if group_id is not None:
+            filters += ' AND posts_post.group_id = %s'
+            filter_params.append(group_id)
+        if author_id is not None:
+            filters += ' AND posts_post.author_id = %s'
+            filter_params.append(author_id)
+
+        # Each side keeps only its best matches, so a common word does not
+        # make the grouping below go over every matching row
+        branches, params = [], []
+        for name, (sql, hits_params) in (
+                ('post_hits', self.post_hits(words)),
+                ('comment_hits', self.comment_hits(words))):
+            branches.append(f'SELECT * FROM ({sql}{filters} '
+                            f'ORDER BY score LIMIT %s) AS {name}')
+            params += [*hits_params, *filter_params, limit]
+        sql = (f'SELECT post_id FROM ({" UNION ALL ".join(branches)}) '
+               f'AS hit GROUP BY post_id '
+               f'ORDER BY MIN(score), post_id DESC LIMIT %s')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, limit])
+            return [post_id for post_id, in cursor.fetchall()]
+
+
+class Fts5Backend(RankedBackend):
+    def match(self, words):
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def post_hits(self, words):
+        return ('SELECT posts_post.id AS post_id, '
+                'bm25(posts_post_fts) AS score FROM posts_post_fts '
+                'JOIN posts_post ON posts_post.id = posts_post_fts.rowid '
+                'WHERE posts_post_fts MATCH %s'), [self.match(words)]
+
+    def comment_hits(self, words):
+        # bm25 is negative, a weight below 1 makes comment hits rank lower
+        return ('SELECT posts_post.id AS post_id, '
+                'bm25(posts_comment_fts) * %s AS score '
+                'FROM posts_comment_fts JOIN posts_post '
+                'ON posts_post.id = posts_comment_fts.post_id '
+                'WHERE posts_comment_fts MATCH %s'), [
+            settings.SEARCH_COMMENT_WEIGHT, self.match(words)]
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts WHERE rowid = %s',
+                           [post.pk])
+            cursor.execute(
+                'INSERT INTO posts_post_fts (rowid, text) VALUES (%s, %s)',
+                [post.pk, post.text])
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts WHERE rowid = %s',
+                           [post_id])
+
+    def index_comment(self, comment):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_comment_fts WHERE rowid = %s',
+                           [comment.pk])
+            if comment.post_id is not None:
+                cursor.execute(
+                    'INSERT INTO posts_comment_fts (rowid, text, post_id) '
+                    'VALUES (%s, %s, %s)',
+                    [comment.pk, comment.text, comment.post_id])
+
+    def remove_comment(self, comment_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_comment_fts WHERE rowid = %s',
+                           [comment_id])
+
+    def remove_post_comments(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM posts_comment_fts WHERE rowid IN '
+                '(SELECT id FROM posts_comment WHERE post_id = %s)',
+                [post_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts')
+            cursor.execute('DELETE FROM posts_comment_fts')
+            cursor.execute('INSERT INTO posts_post_fts (rowid, text) '
+                           'SELECT id, text FROM posts_post')
+            indexed = cursor.rowcount
+            cursor.execute(
+                'INSERT INTO posts_comment_fts (rowid, text, post_id) '
+                'SELECT id, text, post_id FROM posts_comment '
+                'WHERE post_id IS NOT NULL')
+            return indexed + cursor.rowcount
+
+
+class PostgresBackend(RankedBackend):
+    """Searches the GIN indexes on to_tsvector(config, text)."""
+
+    def __init__(self):
+        self.config = settings.SEARCH_POSTGRES_CONFIG
+        if not re.fullmatch(r'\w+', self.config):
+            raise ValueError(f'Bad SEARCH_POSTGRES_CONFIG: {self.config!r}')
+
+    def vector(self, column):
+        # Spelled like the indexed expressions of migration 0023
+        return f"to_tsvector('{self.config}'::regconfig, {column})"
+
+    def query(self):
+        return f"to_tsquery('{self.config}'::regconfig, %s)"
+
+    def match(self, words):
+        return ' & '.join(f'{word}:*' for word in words)
+
+    def post_hits(self, words):
+        vector, query = self.vector('posts_post.text'), self.query()
+        match = self.match(words)
+        return (f'SELECT posts_post.id AS post_id, '
+                f'-ts_rank({vector}, {query}) AS score FROM posts_post '
+                f'WHERE {vector} @@ {query}'), [match, match]
+
+    def comment_hits(self, words):
+        vector, query = self.vector('posts_comment.text'), self.query()
+        match = self.match(words)
+        return (f'SELECT posts_post.id AS post_id, '
+                f'-ts_rank({vector}, {query}) * %s AS score '
+                f'FROM posts_comment JOIN posts_post '
+                f'ON posts_post.id = posts_comment.post_id '
+                f'WHERE {vector} @@ {query}'), [
+            match, settings.SEARCH_COMMENT_WEIGHT, match]
+
+
+def fts5_available():
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+_backends = {}
+
+
+def backend():
+    vendor = connection.vendor
+    if vendor not in _backends:
+        if vendor == 'sqlite' and fts5_available():
+            _backends[vendor] = Fts5Backend()
+        elif vendor == 'postgresql':
+            _backends[vendor] = PostgresBackend()
+        else:
+            _backends[vendor] = LikeBackend()
+    return _backends[vendor]
+
+
+def search(query, group=None, author=None, limit=None):
+    """Ids of the posts matching a query, best match first."""
+    words = terms(query)
+    if not words:
+        return []
+    return backend().search(
+        words,
+        group_id=group.pk if group is not None else None,
+        author_id=author.pk if author is not None else None,
+        limit=limit or settings.SEARCH_MAX_RESULTS,
+    )
@@ -0,0 +1,271 @@
+import threading
+
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from posts import feed_cache, feed_counts, search, timeline
+from posts.cache import group_cache, post_cache, user_cache
+from posts.models import Comment, Follow, Group, Post, User, UserStats
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.push_post(instance)
+
+
+# Ids of the posts this thread is deleting, with their comments
+_deleting = threading.local()
+
+
+def deleting_posts():
+    if not hasattr(_deleting, 'post_ids'):
+        _deleting.post_ids = set()
+    return _deleting.post_ids
+
+
+def deleted_with_post(comment):
+    """Whether the comment goes away with its post, whose own handlers
+    do the work for all its comments."""
+    return getattr(comment, '_deleted_with_post', False)
+
+
+# pre_delete reaches a post before the comments deleted with it, while
+# post_delete may reach it first
+@receiver(pre_delete, sender=Post)
+def remember_deleted_post(sender, instance, **kwargs):
+    deleting_posts().add(instance.pk)
+
+
+@receiver(pre_delete, sender=Comment)
+def mark_deleted_with_post(sender, instance, **kwargs):
+    instance._deleted_with_post = instance.post_id in deleting_posts()
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleted_post(sender, instance, **kwargs):
+    deleting_posts().discard(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.post_id is not None:
+        Post.change_comment_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    if instance.post_id is not None and not deleted_with_post(instance):
+        Post.change_comment_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, raw=False, **kwargs):
+    if not raw:
+        feed_cache.invalidate_author(instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_feeds(sender, instance, raw=False, **kwargs):
+    # The post's own handlers invalidate once for all its comments
+    if raw or instance.post_id is None or deleted_with_post(instance):
+        return
+    row = (Post.objects.filter(pk=instance.post_id)
+           .values_list('author_id', 'group_id').first())
+    if row is not None:
+        author_id, group_id = row
+        feed_cache.invalidate_author(author_id)
+        feed_cache.invalidate_scopes(
+            *feed_cache.post_scopes(instance.post_id, author_id, group_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follower_feed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        feed_cache.invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_index(sender, raw=False, **kwargs):
+    if not raw:
+        feed_cache.invalidate_index()
+
+
+# Connected before count_feed_post, which forgets the saved group
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    scopes = feed_cache.post_scopes(instance.pk, instance.author_id,
+                                    instance.group_id)
+    # A post moved to another group leaves the old group's page
+    saved_group_id = getattr(instance, '_saved_group_id', None)
+    if saved_group_id is not None:
+        scopes.append(f'group:{saved_group_id}')
+    feed_cache.invalidate_scopes(*scopes)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_pages(sender, instance, raw=False, created=False,
+                           **kwargs):
+    if raw:
+        return
+    scopes = [f'group:{instance.pk}']
+    if not created:
+        # Profiles show the group's title on the cards of its posts,
+        # read before a delete sets their group to NULL
+        scopes += [f'author:{author_id}' for author_id in
+                   Post.objects.filter(group=instance)
+                   .values_list('author_id', flat=True).distinct()]
+    feed_cache.invalidate_scopes(*scopes)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.change(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    UserStats.change(instance.author_id, posts_count=-1)
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        instance._saved_group_id = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('group_id', flat=True).first())
+
+
+@receiver(post_save, sender=Post)
+def count_feed_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        feed_counts.change_index(1)
+        feed_counts.change_group(instance.group_id, 1)
+        return
+    saved_group_id = getattr(instance, '_saved_group_id', None)
+    if saved_group_id != instance.group_id:
+        feed_counts.change_group(saved_group_id, -1)
+        feed_counts.change_group(instance.group_id, 1)
+    instance._saved_group_id = instance.group_id
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_feed_post(sender, instance, **kwargs):
+    feed_counts.change_index(-1)
+    feed_counts.change_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.change(instance.author_id, followers_count=1)
+        UserStats.change(instance.user_id, following_count=1)
+        timeline.mark_celebrity(instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    UserStats.change(instance.author_id, followers_count=-1)
+    UserStats.change(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.backend().remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.backend().index_comment(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def unindex_post_comments(sender, instance, **kwargs):
+    search.backend().remove_post_comments(instance.pk)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    if not deleted_with_post(instance):
+        search.backend().remove_comment(instance.pk)
+
+
+def saved_value(model, instance, field, update_fields):
+    """The field as stored before this save, None for new rows."""
+    if instance._state.adding or (update_fields is not None
+                                  and field not in update_fields):
+        return None
+    return (model.objects.filter(pk=instance.pk)
+            .values_list(field, flat=True).first())
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, raw=False, update_fields=None,
+                      **kwargs):
+    if not raw:
+        instance._saved_username = saved_value(User, instance, 'username',
+                                               update_fields)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def uncache_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.username,
+                          getattr(instance, '_saved_username', None))
+
+
+@receiver(pre_save, sender=Group)
+def remember_slug(sender, instance, raw=False, update_fields=None,
+                  **kwargs):
+    if not raw:
+        instance._saved_slug = saved_value(Group, instance, 'slug',
+                                           update_fields)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def uncache_group(sender, instance, **kwargs):
+    group_cache.invalidate(instance.slug,
+                           getattr(instance, '_saved_slug', None))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def uncache_post(sender, instance, **kwargs):
+    post_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def uncache_commented_post(sender, instance, **kwargs):
+    # The post's comment_count has changed
+    post_cache.invalidate(instance.post_id)
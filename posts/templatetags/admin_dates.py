@@ -0,0 +1,111 @@
+import calendar
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.utils import formats, timezone
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+register = template.Library()
+
+
+def date_range(cl, field_name):
+    """The first and last dates of the changelist, one index lookup each
+    (an aggregate of both would scan on SQLite)."""
+    dates = cl.queryset.order_by().values_list(field_name, flat=True)
+    first = dates.order_by(field_name).first()
+    last = dates.order_by(f'-{field_name}').first()
+    if first is None or last is None:
+        return None, None
+    if isinstance(first, datetime.datetime):
+        first = timezone.localtime(first).date()
+        last = timezone.localtime(last).date()
+    return first, last
+
+
+def bounded_date_hierarchy(cl):
+    """The admin's date_hierarchy, with links to every year, month or day
+    between the first and the last date of the changelist instead of the
+    distinct ones, which are read by scanning all its rows."""
+    field_name = cl.date_hierarchy
+    year_field = f'{field_name}__year'
+    month_field = f'{field_name}__month'
+    day_field = f'{field_name}__day'
+    year_lookup = cl.params.get(year_field)
+    month_lookup = cl.params.get(month_field)
+    day_lookup = cl.params.get(day_field)
+
+    def link(filters):
+        return cl.get_query_string(filters, [f'{field_name}__'])
+
+    if year_lookup and month_lookup and day_lookup:
+        day = datetime.date(int(year_lookup), int(month_lookup),
+                            int(day_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup,
+                              month_field: month_lookup}),
+                'title': capfirst(formats.date_format(day,
+                                                      'YEAR_MONTH_FORMAT')),
+            },
+            'choices': [{'title': capfirst(
+                formats.date_format(day, 'MONTH_DAY_FORMAT'))}],
+        }
+
+    first, last = date_range(cl, field_name)
+    if first is None:
+        return {'show': True, 'back': None, 'choices': []}
+    if not year_lookup and first.year == last.year:
+        year_lookup = first.year
+        if first.month == last.month:
+            month_lookup = first.month
+
+    if year_lookup and month_lookup:
+        year, month = int(year_lookup), int(month_lookup)
+        start = first.day if (first.year, first.month) == (year, month) else 1
+        end = (last.day if (last.year, last.month) == (year, month)
+               else calendar.monthrange(year, month)[1])
+        return {
+            'show': True,
+            'back': {'link': link({year_field: year_lookup}),
+                     'title': str(year_lookup)},
+            'choices': [{
+                'link': link({year_field: year_lookup,
+                              month_field: month_lookup, day_field: day}),
+                'title': capfirst(formats.date_format(
+                    datetime.date(year, month, day), 'MONTH_DAY_FORMAT')),
+            } for day in range(start, end + 1)],
+        }
+    if year_lookup:
+        year = int(year_lookup)
+        months = range(first.month if first.year == year else 1,
+                       (last.month if last.year == year else 12) + 1)
+        return {
+            'show': True,
+            'back': {'link': link({}), 'title': _('All dates')},
+            'choices': [{
+                'link': link({year_field: year_lookup, month_field: month}),
+                'title': capfirst(formats.date_format(
+                    datetime.date(year, month, 1), 'YEAR_MONTH_FORMAT')),
+            } for month in months],
+        }
+    return {
+        'show': True,
+        'back': None,
+        'choices': [{'link': link({year_field: str(year)}),
+                     'title': str(year)}
+                    for year in range(first.year, last.year + 1)],
+    }
+
+
+@register.tag(name='bounded_date_hierarchy')
+def bounded_date_hierarchy_tag(parser, token):
+    """Usage: {% bounded_date_hierarchy cl %}"""
+    return InclusionAdminNode(
+        parser, token,
+        func=bounded_date_hierarchy,
+        template_name='date_hierarchy.html',
+        takes_context=False,
+    )
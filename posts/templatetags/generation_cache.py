@@ -0,0 +1,58 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from posts.feed_cache import get_or_build
+from posts.page_cache import adopt, detach, mark_stale
+
+register = template.Library()
+
+
+class GenerationCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, fragment_name, generation,
+                 vary_on):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+        self.generation = generation
+        self.vary_on = vary_on
+
+    def render(self, context):
+        timeout = self.timeout.resolve(context)
+        generation = self.generation.resolve(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        request = getattr(context, 'request', None)
+        # Hole markers are cached with their nonce, see posts.page_cache
+        fragment = get_or_build(
+            key, generation, timeout,
+            lambda: detach(request, self.nodelist.render(context)),
+            on_stale=lambda: mark_stale(request))
+        return adopt(request, *fragment)
+
+
+@register.tag('generation_cache')
+def do_generation_cache(parser, token):
+    """Like {% cache %}, but the fragment is valid for one generation.
+
+    Usage::
+
+        {% generation_cache timeout name generation [vary_on ...] %}
+            ...
+        {% endgeneration_cache %}
+
+    An outdated fragment is served while one request rebuilds it, the
+    page is then not cached (see posts.page_cache.mark_stale).
+    """
+    nodelist = parser.parse(('endgeneration_cache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 4:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' tag requires at least 3 arguments.")
+    return GenerationCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        bits[2],
+        parser.compile_filter(bits[3]),
+        [parser.compile_filter(bit) for bit in bits[4:]],
+    )
@@ -0,0 +1,28 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.page_cache import HOLES, marker
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **values):
+    """Usage: {% hole 'post_edit_link' username=... post_id=... %}
+
+    In a page shell (see posts.page_cache) writes a marker that is
+    replaced per request, anywhere else renders the fragment in place
+    like an include, with what the page has in its context.
+    """
+    request = getattr(context, 'request', None) or context.get('request')
+    if context.get('page_shell') or getattr(request, 'page_shell', False):
+        return mark_safe(marker(request, name, values))
+    fragment = HOLES[name]
+    extra = {}
+    if fragment.extra_context is not None and request is not None:
+        extra = {key: value for key, value
+                 in fragment.extra_context(request, **values).items()
+                 if key not in context}
+    template_ = context.template.engine.get_template(fragment.template_name)
+    with context.push(**extra, **values):
+        return template_.render(context)
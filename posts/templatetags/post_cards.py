@@ -0,0 +1,40 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from posts.feed_cache import card_key
+from posts.page_cache import adopt, hole_nonce
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Usage: {% post_cards page %}
+
+    Renders post_item.html for every post like an include in a loop
+    would, reusing the cards cached by earlier requests: one get_many
+    for the whole page, only the missing cards are rendered. Cards are
+    the same for every viewer, their edit links are holes filled in by
+    posts.page_cache.PageHolesMiddleware.
+    """
+    request = context.request
+    posts = list(posts)
+    keys = [card_key(post) for post in posts]
+    # (nonce, card): the holes of a card are rebound to this response
+    cards = cache.get_many(keys)
+    missing = {}
+    item = None
+    for key, post in zip(keys, posts):
+        if key in cards:
+            continue
+        if item is None:
+            item = get_template('post_item.html')
+        card = item.render({'post': post, 'page_shell': True,
+                            'request': request})
+        missing[key] = cards[key] = (hole_nonce(request), card)
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+    return mark_safe(''.join(adopt(request, *cards[key]) for key in keys))
@@ -0,0 +1,24 @@
+import logging
+
+from django import template
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from posts.thumbnails import ResponsiveImage
+
+logger = logging.getLogger(__name__)
+register = template.Library()
+
+
+@register.simple_tag
+def post_image(image):
+    """Usage: {% post_image post.image as image %}"""
+    if not image:
+        return None
+    try:
+        return ResponsiveImage(image)
+    except Exception:
+        # Like {% thumbnail %}: a broken image must not break the page
+        if sorl_settings.THUMBNAIL_DEBUG:
+            raise
+        logger.exception('Could not show the image %s', image)
+        return None
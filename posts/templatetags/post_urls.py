@@ -0,0 +1,72 @@
+"""Memoized {% url %} for the posts.urls patterns.
+
+Feeds and comment lists reverse the same handful of patterns for every
+item. The reversed URLs are kept in an LRU of POST_URL_CACHE_SIZE
+entries keyed by everything reverse() depends on: the URLconf, the
+script prefix, the view name and the arguments.
+
+Usage::
+
+    {% load post_urls %}
+    <a href="{% profile_url post.author.username %}">
+"""
+from functools import lru_cache
+
+from django import template
+from django.conf import settings
+from django.urls import get_script_prefix, get_urlconf, reverse
+
+register = template.Library()
+
+
+@lru_cache(maxsize=settings.POST_URL_CACHE_SIZE)
+def _reverse(urlconf, prefix, view_name, args):
+    # prefix is only part of the key, reverse() reads it itself
+    return reverse(view_name, urlconf=urlconf, args=args)
+
+
+def cached_reverse(view_name, *args):
+    """reverse(view_name, args=args), remembered."""
+    urlconf = get_urlconf() or settings.ROOT_URLCONF
+    args = tuple(str(arg) for arg in args)
+    return _reverse(urlconf, get_script_prefix(), view_name, args)
+
+
+@register.simple_tag
+def profile_url(username):
+    return cached_reverse('profile', username)
+
+
+@register.simple_tag
+def group_url(slug):
+    return cached_reverse('group_posts', slug)
+
+
+@register.simple_tag
+def post_url(username, post_id):
+    return cached_reverse('post_view', username, post_id)
+
+
+@register.simple_tag
+def post_edit_url(username, post_id):
+    return cached_reverse('post_edit', username, post_id)
+
+
+@register.simple_tag
+def add_comment_url(username, post_id):
+    return cached_reverse('add_comment', username, post_id)
+
+
+@register.simple_tag
+def post_comments_url(username, post_id):
+    return cached_reverse('post_comments', username, post_id)
+
+
+@register.simple_tag
+def follow_url(username):
+    return cached_reverse('profile_follow', username)
+
+
+@register.simple_tag
+def unfollow_url(username):
+    return cached_reverse('profile_unfollow', username)
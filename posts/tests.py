@@ -1,8 +1,71 @@
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import Future
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
-from django.test import TestCase, override_settings
-from django.urls import reverse
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, set_script_prefix
+from django.utils import timezone
+from django.utils.http import http_date
+
+from posts import (feed_cache, feed_counts, page_cache, search, thumbnails,
+                   timeline)
+from posts.cache import group_cache, post_cache, user_cache
+from posts.forms import PostForm
+from posts.models import User, Post, Group, Follow, Comment, UserStats
+from posts.paginator import CursorPaginator
+from posts.templatetags import post_urls
+from posts.uploads import open_downsampled
+
+
+# Peak RSS of a process before and after compact_image(argv[1])
+RSS_SCRIPT = """
+import resource, sys
+import django
+django.setup()
+from django.core.files import File
+from posts.uploads import compact_image
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with open(sys.argv[1], 'rb') as upload:
+    compact_image(File(upload, name='upload'))
+print(before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
 
-from posts.models import User, Post, Group, Follow
+class QueryBudgetMixin:
+    """Mixin for TestCase: fail when a page needs more queries than its
+    budget, printing the offending SQL."""
+
+    def assertQueryBudget(self, budget, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        if len(queries) > budget:
+            sql = '\n'.join(query['sql'] for query in queries)
+            self.fail(f'{url} made {len(queries)} queries, '
+                      f'budget is {budget}:\n{sql}')
+        return response
 
 
 class TestPostCreation(TestCase):
@@ -223,11 +286,32 @@ class TestCache(TestCase):
         self.text = 'test_text'
 
     def test_index_cache(self):
-        # Create a cached page and check that there's no new post yet.
+        # A cached page is served until something changes
+        cache.clear()
+        Post.objects.create(text=self.text, author=self.user)
+        self.client.get(reverse('index'))
+        Post.objects.filter(author=self.user).update(text='hidden')
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'hidden')
+
+    def test_index_cache_invalidation(self):
+        # A new post shows up on the cached page at once
+        cache.clear()
         self.client.get(reverse('index'))
         self.client.post(reverse('new_post'), {'text': self.text})
         response = self.client.get(reverse('index'))
-        self.assertNotContains(response, self.text)
+        self.assertContains(response, self.text)
+
+    def test_stale_page_served_during_rebuild(self):
+        # Only the lock holder rebuilds, others get the old fragment
+        cache.clear()
+        built = []
+        feed_cache.get_or_build('key', 'old', 60, lambda: 'old page')
+        cache.add('key:rebuild', 'new', 60)
+        value = feed_cache.get_or_build(
+            'key', 'new', 60, lambda: built.append(1) or 'new page')
+        self.assertEqual(value, 'old page')
+        self.assertEqual(built, [])
 
 
 class TestFollowerSystem(TestCase):
@@ -307,3 +391,1424 @@ class TestCommentSystem(TestCase):
             {'text': self.comment_text}, follow=True)
         self.assertNotContains(response, self.comment_text)
 
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class TestCursorPagination(TestCase):
+    """Test for keyset pagination of the feeds and the ?page=N fallback"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        # 25 posts, ids ascending with pub_date
+        for i in range(25):
+            Post.objects.create(text=f'post_{i}', author=self.user)
+        self.expected = list(Post.objects.order_by('-pub_date', '-pk'))
+
+    def test_walk_feed_by_cursor(self):
+        # Follow next cursors from the first page to the end and back
+        response = self.client.get(reverse('index'))
+        page = response.context['page']
+        seen = list(page)
+        self.assertFalse(page.has_previous())
+        while page.has_next():
+            response = self.client.get(reverse('index'),
+                                       {'cursor': page.next_cursor})
+            page = response.context['page']
+            seen += list(page)
+        self.assertEqual(seen, self.expected)
+
+        response = self.client.get(reverse('index'),
+                                   {'cursor': page.previous_cursor})
+        self.assertEqual(list(response.context['page']), self.expected[10:20])
+
+    def test_no_count_query(self):
+        with self.assertNumQueries(1):
+            page = CursorPaginator(Post.objects.all(), 10).get_page(None)
+            self.assertEqual(len(page), 10)
+
+    def test_legacy_page_number(self):
+        response = self.client.get(reverse('index'), {'page': 2})
+        page = response.context['page']
+        self.assertEqual(page.number, 2)
+        self.assertEqual(list(page), self.expected[10:20])
+
+        response = self.client.get(reverse('index'), {'page': 4000})
+        self.assertEqual(list(response.context['page']), self.expected[20:])
+
+    def test_broken_cursor(self):
+        response = self.client.get(reverse('index'), {'cursor': 'qwe!'})
+        self.assertEqual(list(response.context['page']), self.expected[:10])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class TestTimeline(TestCase):
+    """Test for the materialized follow feed"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.author = User.objects.create_user(username='testauthor',
+                                               password=12345)
+        self.client.force_login(self.user)
+        self.old_post = Post.objects.create(text='old_post',
+                                            author=self.author)
+
+    def follow(self):
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': self.author.username}))
+
+    def test_fan_out_on_write(self):
+        self.follow()
+        # Following backfills the posts published before
+        self.assertTrue(
+            self.user.timeline.filter(post=self.old_post).exists())
+
+        post = Post.objects.create(text='new_post', author=self.author)
+        self.assertTrue(self.user.timeline.filter(post=post).exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']),
+                         [post, self.old_post])
+
+    def test_unfollow_purges_timeline(self):
+        self.follow()
+        self.client.get(reverse('profile_unfollow',
+                                kwargs={'username': self.author.username}))
+        self.assertFalse(self.user.timeline.exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertNotContains(response, self.old_post.text)
+
+    @override_settings(TIMELINE_SIZE=2)
+    def test_timeline_size_cap(self):
+        self.follow()
+        for i in range(3):
+            Post.objects.create(text=f'post_{i}', author=self.author)
+        # Trimmed on write, reads don't touch the timeline
+        self.assertEqual(self.user.timeline.count(), 2)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_fan_out_on_read_for_popular_authors(self):
+        self.follow()
+        post = Post.objects.create(text='new_post', author=self.author)
+        self.assertFalse(self.user.timeline.exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']),
+                         [post, self.old_post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_popular_author_stays_on_read(self):
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        self.follow()
+        post = Post.objects.create(text='celebpost', author=self.author)
+        # Back to the limit, the post was never pushed to the timeline
+        Follow.objects.filter(user=reader).delete()
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']),
+                         [post, self.old_post])
+        another = Post.objects.create(text='another', author=self.author)
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['page'][0], another)
+
+    def test_feed_pages_on_timeline(self):
+        self.follow()
+        posts = [Post.objects.create(text=f'post_{i}', author=self.author)
+                 for i in range(3)]
+        paginator = CursorPaginator(timeline.feed(self.user), 2,
+                                    **timeline.FEED_ORDER)
+        page = paginator.get_page(None)
+        self.assertEqual(list(page), posts[:0:-1])
+        page = paginator.get_page(None, cursor=page.next_cursor)
+        self.assertEqual(list(page), [posts[0], self.old_post])
+        plan = paginator.object_list.explain()
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class TestCommentCounter(TestCase):
+    """Test for the stored Post.comment_count counter"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(text='test_text', author=self.user)
+
+    def test_counter_follows_comments(self):
+        self.client.post(
+            reverse('add_comment', kwargs={'username': self.user.username,
+                                           'post_id': self.post.pk}),
+            {'text': 'test_comment'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        self.post.post_comments.get().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+    def test_post_save_keeps_counter(self):
+        # A stale instance must not overwrite the counter
+        Comment.objects.create(post=self.post, author=self.user, text='c')
+        self.post.text = 'edited'
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_post_delete_skips_counter(self):
+        for _ in range(3):
+            Comment.objects.create(post=self.post, author=self.user,
+                                   text='c')
+        with CaptureQueriesContext(connection) as queries:
+            self.post.delete()
+        self.assertFalse(any('"comment_count"' in query['sql']
+                             for query in queries))
+        other = Post.objects.create(text='other', author=self.user)
+        Comment.objects.create(post=other, author=self.user, text='c')
+        other.post_comments.get().delete()
+        other.refresh_from_db()
+        self.assertEqual(other.comment_count, 0)
+
+    def test_no_comment_queries_on_index(self):
+        cache.clear()
+        for _ in range(3):
+            Comment.objects.create(post=self.post, author=self.user,
+                                   text='c')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, '3 комментариев')
+        self.assertFalse(any('posts_comment' in query['sql']
+                             for query in queries))
+
+    def test_recount_command(self):
+        Comment.objects.create(post=self.post, author=self.user, text='c')
+        Post.objects.update(comment_count=42)
+        call_command('recount_comments', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class TestFeedQueryBudget(QueryBudgetMixin, TestCase):
+    """Test that feeds run a constant number of queries per page"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.group = Group.objects.create(title='Test group',
+                                          slug='test-group',
+                                          description='description')
+        # Every post has its own author and group to expose N+1 queries
+        for i in range(10):
+            author = User.objects.create_user(username=f'author_{i}')
+            group = Group.objects.create(title=f'group_{i}',
+                                         slug=f'group-{i}',
+                                         description='description')
+            Follow.objects.create(user=self.user, author=author)
+            post = Post.objects.create(text=f'post_{i}', author=author,
+                                       group=group)
+            Comment.objects.create(post=post, author=author, text='c')
+            Post.objects.create(text=f'group_post_{i}', author=self.user,
+                                group=self.group)
+
+    # The pages below count one query for their conditional GET
+    # validators, see posts.conditional
+
+    def test_index(self):
+        # And one to count the posts for the page links, cached after
+        cache.clear()
+        self.assertQueryBudget(3, reverse('index'))
+
+    def test_group_posts(self):
+        self.assertQueryBudget(
+            3, reverse('group_posts', kwargs={'slug': self.group.slug}))
+
+    def test_profile(self):
+        self.assertQueryBudget(
+            3, reverse('profile', kwargs={'username': self.user.username}))
+
+    def test_follow_index(self):
+        self.client.force_login(self.user)
+        # The followed popular authors are looked up twice without a cache
+        self.assertQueryBudget(6, reverse('follow_index'))
+
+
+class TestFollowFeedCache(TestCase):
+    """Test for the per-user versioned follow feed cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.other_user = User.objects.create_user(username='otheruser',
+                                                   password=12345)
+        self.author = User.objects.create_user(username='testauthor',
+                                               password=12345)
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text='followed_post', author=self.author)
+
+    def test_feed_is_not_shared_between_users(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('follow_index')),
+                            'followed_post')
+        self.client.force_login(self.other_user)
+        self.assertNotContains(self.client.get(reverse('follow_index')),
+                               'followed_post')
+
+    def test_post_delete_invalidates_once(self):
+        post = Post.objects.get()
+        for _ in range(3):
+            Comment.objects.create(post=post, author=self.user, text='c')
+        with mock.patch('posts.feed_cache.invalidate_author') as invalidate:
+            post.delete()
+        invalidate.assert_called_once_with(self.author.pk)
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(reverse('follow_index')),
+                               'followed_post')
+
+    def test_new_post_invalidates_feed(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('follow_index'))
+        Post.objects.create(text='fresh_post', author=self.author)
+        self.assertContains(self.client.get(reverse('follow_index')),
+                            'fresh_post')
+
+    def test_unfollow_invalidates_feed(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('follow_index'))
+        self.client.get(reverse('profile_unfollow',
+                                kwargs={'username': self.author.username}))
+        self.assertNotContains(self.client.get(reverse('follow_index')),
+                               'followed_post')
+
+    def test_unrelated_post_keeps_feed_cached(self):
+        self.client.force_login(self.user)
+        version = feed_cache.feed_version(self.user)
+        Post.objects.create(text='unrelated', author=self.other_user)
+        self.assertEqual(feed_cache.feed_version(self.user), version)
+
+
+@override_settings(THUMBNAIL_WORKERS=0, CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class TestThumbnailPregeneration(TestCase):
+    """Test that thumbnails are made outside the page render"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings.enable()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media.cleanup()
+
+    def get_image(self):
+        image = BytesIO()
+        Image.new('RGB', (100, 100), color=(255, 0, 0)).save(image, 'JPEG')
+        return SimpleUploadedFile('image.jpg', image.getvalue(),
+                                  content_type='image/jpeg')
+
+    def test_new_post_pregenerates_thumbnail(self):
+        self.client.post(reverse('new_post'),
+                         {'text': 'test_text', 'image': self.get_image()})
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '/media/cache/')
+        self.assertNotContains(response, 'data:image/svg+xml')
+
+    @override_settings(THUMBNAIL_WORKERS=2)
+    def test_placeholder_until_ready(self):
+        post = Post.objects.create(text='test_text', author=self.user)
+        post.image.save('image.jpg', self.get_image())
+        with mock.patch('posts.thumbnails.enqueue',
+                        side_effect=lambda *args: Future()) as enqueue:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'data:image/svg+xml')
+        self.assertEqual(enqueue.call_count, len(list(thumbnails.variants())))
+
+    def test_inline_render_gets_thumbnail(self):
+        post = Post.objects.create(text='test_text', author=self.user)
+        post.image.save('image.jpg', self.get_image())
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '/media/cache/')
+        self.assertNotContains(response, 'data:image/svg+xml')
+
+    @override_settings(THUMBNAIL_WORKERS=2)
+    def test_render_never_generates_with_pool(self):
+        post = Post.objects.create(text='test_text', author=self.user)
+        post.image.save('image.jpg', self.get_image())
+        with mock.patch.object(thumbnails.PregeneratingBackend,
+                               'generate') as generate:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'data:image/svg+xml')
+        generate.assert_not_called()
+
+    def test_ready_once_per_image(self):
+        with mock.patch('posts.thumbnails.image_ready',
+                        wraps=thumbnails.image_ready) as image_ready:
+            self.client.post(reverse('new_post'),
+                             {'text': 'test_text', 'image': self.get_image()})
+        # Not once per variant
+        image_ready.assert_called_once()
+        self.assertTrue(Post.objects.get().thumbnails_ready)
+
+    def test_new_image_not_ready(self):
+        self.client.post(reverse('new_post'),
+                         {'text': 'test_text', 'image': self.get_image()})
+        post = Post.objects.get()
+        with mock.patch('posts.thumbnails.enqueue'):
+            self.client.post(reverse('post_edit', kwargs={
+                'username': 'testuser', 'post_id': post.pk}),
+                {'text': 'test_text', 'image': self.get_image()})
+        self.assertFalse(Post.objects.get().thumbnails_ready)
+
+    @override_settings(THUMBNAIL_WORKERS=2)
+    def test_pool_waits_for_commit(self):
+        with mock.patch('posts.thumbnails._get_executor') as executor:
+            with transaction.atomic():
+                thumbnails.enqueue('image.jpg', '10x10', {})
+            # The test itself never commits
+            executor.assert_not_called()
+
+    def test_srcset(self):
+        self.client.post(reverse('new_post'),
+                         {'text': 'test_text', 'image': self.get_image()})
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, '<source type="image/webp"')
+        for width in settings.POST_IMAGE_VARIANT_WIDTHS:
+            self.assertContains(response, f' {width}w', count=2)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class TestMakeThumbnailsCommand(TransactionTestCase):
+    """Test for backfilling the image variants of existing posts"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings.enable()
+        user = User.objects.create_user(username='testuser')
+        image = BytesIO()
+        Image.new('RGB', (100, 100), color=(255, 0, 0)).save(image, 'JPEG')
+        for i in range(3):
+            post = Post.objects.create(text=f'post_{i}', author=user)
+            post.image.save(f'image_{i}.jpg', ContentFile(image.getvalue()))
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media.cleanup()
+
+    def test_backfill(self):
+        # One worker: the in-memory test database can't take concurrent
+        # writes
+        call_command('make_thumbnails', workers=1, stdout=StringIO())
+        for post in Post.objects.all():
+            image = thumbnails.ResponsiveImage(post.image)
+            self.assertIsNone(image.placeholder)
+            self.assertEqual(len(image.sources['JPEG']),
+                             len(settings.POST_IMAGE_VARIANT_WIDTHS))
+
+
+class TestImageUpload(TestCase):
+    """Test for the bounded-memory upload pipeline of PostForm"""
+
+    def get_jpeg(self, size):
+        exif = Image.Exif()
+        exif[0x010F] = 'Phone maker'
+        image = BytesIO()
+        Image.new('RGB', size, color=(255, 0, 0)).save(image, 'JPEG',
+                                                       exif=exif)
+        return SimpleUploadedFile('photo.jpeg', image.getvalue(),
+                                  content_type='image/jpeg')
+
+    def test_upload_is_compacted(self):
+        form = PostForm({'text': 'test_text'},
+                        {'image': self.get_jpeg((4000, 3000))})
+        self.assertTrue(form.is_valid(), form.errors)
+        image = Image.open(form.cleaned_data['image'])
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (1920, 1440))
+        self.assertNotIn('exif', image.info)
+        self.assertEqual(form.cleaned_data['image'].name, 'photo.jpg')
+
+    def test_decode_memory_ceiling(self):
+        # Whatever the upload resolution, the decoded pixels stay within
+        # 2x POST_IMAGE_MAX_SIZE in each dimension
+        width, height = settings.POST_IMAGE_MAX_SIZE
+        ceiling = (2 * width) * (2 * height) * 3
+        for size in ((4000, 3000), (8000, 6000)):
+            with mock.patch.object(Image.Image, 'thumbnail'):
+                image = open_downsampled(self.get_jpeg(size),
+                                         settings.POST_IMAGE_MAX_SIZE)
+                image.load()
+            self.assertLessEqual(image.size[0] * image.size[1] * 3, ceiling)
+
+    def peak_rss_growth(self, image, image_format):
+        """Bytes the peak RSS of a fresh process grows by in
+        compact_image(image), Pillow's buffers included."""
+        with tempfile.NamedTemporaryFile() as file:
+            image.save(file, image_format)
+            file.flush()
+            result = subprocess.run(
+                [sys.executable, '-c', RSS_SCRIPT, file.name],
+                cwd=settings.BASE_DIR, stdout=subprocess.PIPE, check=True,
+                env={**os.environ,
+                     'DJANGO_SETTINGS_MODULE': 'yatube.settings'})
+        before, after = map(int, result.stdout.split())
+        # ru_maxrss is in KiB on Linux
+        return (after - before) * 1024
+
+    @skipUnless(resource, 'needs the resource module')
+    def test_memory_ceiling(self):
+        # The largest uploads allowed, as JPEG and as transparent PNG
+        ceiling = 160 * 1024 * 1024
+        jpeg = Image.new('RGB', (8000, 6000), color=(255, 0, 0))
+        self.assertLess(self.peak_rss_growth(jpeg, 'JPEG'), ceiling)
+        png = Image.new('RGBA', (4000, 3000), color=(255, 0, 0, 128))
+        self.assertLess(self.peak_rss_growth(png, 'PNG'), ceiling)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        form = PostForm({'text': 'test_text'},
+                        {'image': self.get_jpeg((100, 100))})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    @override_settings(POST_IMAGE_MAX_DECODED_PIXELS=1000)
+    def test_too_many_pixels_without_draft(self):
+        image = BytesIO()
+        Image.new('RGB', (100, 100)).save(image, 'PNG')
+        form = PostForm({'text': 'test_text'},
+                        {'image': SimpleUploadedFile(
+                            'image.png', image.getvalue(),
+                            content_type='image/png')})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+
+class TestUserStats(TestCase):
+    """Test for the stored follower, following and post counters"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.author = User.objects.create_user(username='testauthor',
+                                               password=12345)
+        self.client.force_login(self.user)
+
+    def assertStats(self, user, followers, following, posts):
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.followers_count, stats.following_count,
+             stats.posts_count),
+            (followers, following, posts))
+
+    def test_counters(self):
+        self.client.post(reverse('new_post'), {'text': 'test_text'})
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': self.author.username}))
+        self.assertStats(self.user, 0, 1, 1)
+        self.assertStats(self.author, 1, 0, 0)
+
+        self.client.get(reverse('profile_unfollow',
+                                kwargs={'username': self.author.username}))
+        Post.objects.get().delete()
+        self.assertStats(self.user, 0, 0, 0)
+        self.assertStats(self.author, 0, 0, 0)
+
+    def test_profile_renders_counters(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text='test_text', author=self.author)
+        response = self.client.get(
+            reverse('profile', kwargs={'username': self.author.username}))
+        self.assertContains(response, 'Подписчиков: 1')
+        self.assertContains(response, 'Записей: 1')
+
+    def test_recount_command(self):
+        Post.objects.create(text='test_text', author=self.author)
+        UserStats.objects.all().delete()
+        call_command('recount_user_stats', stdout=StringIO())
+        self.assertStats(self.author, 0, 0, 1)
+        self.assertStats(self.user, 0, 0, 0)
+
+
+class TestFeedIndexes(TestCase):
+    """Test for the Follow uniqueness constraint and the plan report"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.author = User.objects.create_user(username='testauthor',
+                                               password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group')
+        Post.objects.create(text='test_text', author=self.author,
+                            group=self.group)
+        Follow.objects.create(user=self.user, author=self.author)
+
+    def test_follow_is_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.author)
+
+    def test_explain_queries(self):
+        out = StringIO()
+        call_command('explain_queries', repeat=1, depth=0, stdout=out)
+        self.assertIn('follow_index', out.getvalue())
+        self.assertIn('post_group_pub_date_idx', out.getvalue())
+
+
+class TestLoadTools(TestCase):
+    """Test for the seed_data and benchmark commands"""
+
+    def setUp(self):
+        call_command('seed_data', users=30, groups=3, posts=300, follows=3,
+                     comments=100, stdout=StringIO())
+
+    def test_seed_data(self):
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertTrue(Follow.objects.exists())
+        for user in User.objects.select_related('stats'):
+            counted = UserStats.counted(user.pk)
+            self.assertEqual(
+                (user.stats.followers_count, user.stats.posts_count),
+                (counted.followers_count, counted.posts_count))
+        post = Post.objects.order_by('-comment_count').first()
+        self.assertEqual(post.comment_count, post.post_comments.count())
+
+        follow = Follow.objects.first()
+        expected = set(Post.objects.filter(
+            author__following__user=follow.user)
+            .values_list('pk', flat=True))
+        self.assertEqual(
+            set(follow.user.timeline.values_list('post', flat=True)),
+            expected)
+
+    def test_benchmark(self):
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.json') as file:
+            call_command('benchmark', requests=3, warmup=0,
+                         output=file.name, stdout=StringIO())
+            report = json.load(file)
+        self.assertEqual(report['rows']['Post'], 300)
+        for view in ('index', 'group_posts', 'profile', 'post_view',
+                     'follow_index', 'add_comment'):
+            result = report['results'][view]
+            self.assertEqual(result['requests'], 3)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreaterEqual(result['p99_ms'], result['p50_ms'])
+            self.assertGreater(result['queries_mean'], 0)
+
+
+class TestSearch(QueryBudgetMixin, TestCase):
+    """Test for the full-text search of posts and comments"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.author = User.objects.create_user(username='testauthor',
+                                               password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group')
+        self.river = Post.objects.create(text='Тихая река у старого дома',
+                                         author=self.author,
+                                         group=self.group)
+        self.city = Post.objects.create(text='Ночной город', author=self.user)
+        Comment.objects.create(post=self.city, author=self.user,
+                               text='Как река')
+
+    def test_post_and_comment_text(self):
+        self.assertEqual(search.search('река'), [self.river.pk, self.city.pk])
+        self.assertEqual(search.search('рек'), [self.river.pk, self.city.pk])
+        self.assertEqual(search.search('река дом'), [self.river.pk])
+        self.assertEqual(search.search('"; DROP'), [])
+        self.assertEqual(search.search('...'), [])
+
+    def test_filters(self):
+        self.assertEqual(search.search('река', group=self.group),
+                         [self.river.pk])
+        self.assertEqual(search.search('река', author=self.user),
+                         [self.city.pk])
+
+    def test_index_follows_changes(self):
+        self.river.text = 'Широкое море'
+        self.river.save()
+        self.assertEqual(search.search('река'), [self.city.pk])
+        self.assertEqual(search.search('море'), [self.river.pk])
+        self.city.delete()
+        self.assertEqual(search.search('река'), [])
+
+    def test_post_delete_unindexes_comments(self):
+        if not isinstance(search.backend(), search.Fts5Backend):
+            self.skipTest('No FTS tables on this database')
+        for _ in range(3):
+            Comment.objects.create(post=self.city, author=self.user,
+                                   text='река')
+        with CaptureQueriesContext(connection) as queries:
+            self.city.delete()
+        # One DELETE for all the comments
+        self.assertEqual(sum('posts_comment_fts' in query['sql']
+                             for query in queries), 1)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM posts_comment_fts')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts')
+        self.assertEqual(search.search('дом'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search.search('дом'), [self.river.pk])
+
+    def test_search_page(self):
+        response = self.client.get(reverse('post_search'),
+                                   {'q': 'река', 'group': 'test_group'})
+        self.assertEqual(list(response.context['page']), [self.river])
+        self.assertContains(response, 'Найдено записей: 1')
+        response = self.client.get(reverse('post_search'),
+                                   {'q': 'река', 'author': 'nobody'})
+        self.assertContains(response, 'Нет такого автора.')
+        self.assertQueryBudget(3, reverse('post_search'), {'q': 'река'})
+
+    def test_admin_search(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password=12345)
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:posts_post_changelist'),
+                                   {'q': 'город'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.city])
+
+
+class TestPostCards(TestCase):
+    """Test for the cached post cards of the feeds"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.author = User.objects.create_user(username='testauthor',
+                                               password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group')
+        self.post = Post.objects.create(text='test_text', author=self.author,
+                                        group=self.group)
+        self.url = reverse('group_posts', kwargs={'slug': self.group.slug})
+
+    def card_key(self):
+        post = Post.objects.select_related('author', 'group').get()
+        return feed_cache.card_key(post)
+
+    def test_card_reused(self):
+        self.client.get(self.url)
+        cache.set(self.card_key(), (None, 'cached card'))
+        # Another path, the page itself is cached under the first one
+        self.assertContains(self.client.get(self.url, {'page': 1}),
+                            'cached card')
+
+    def test_changes_make_new_card(self):
+        self.client.get(self.url)
+        Comment.objects.create(post=self.post, author=self.user, text='c')
+        self.assertContains(self.client.get(self.url), '1 комментариев')
+        self.group.title = 'new_title'
+        self.group.save()
+        self.assertContains(self.client.get(self.url), '#new_title')
+
+    def test_edit_link_for_author_only(self):
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(self.url), 'Редактировать')
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(self.url), 'Редактировать')
+
+    def test_cached_card_holes_filled(self):
+        self.client.get(self.url)
+        self.client.force_login(self.author)
+        # A new shell with the card cached by the first response
+        response = self.client.get(self.url, {'page': 1})
+        self.assertContains(response, 'Редактировать')
+        self.assertNotContains(response, '\x00')
+
+    def test_thumbnail_ready_makes_new_card(self):
+        Post.objects.filter(pk=self.post.pk).update(image='posts/image.jpg')
+        self.client.get(self.url)
+        placeholder_key = self.card_key()
+        self.assertIsNotNone(cache.get(placeholder_key))
+        thumbnails.image_ready('posts/image.jpg')
+        self.assertNotEqual(self.card_key(), placeholder_key)
+
+
+class TestPostUrls(TestCase):
+    """Test for the memoized URL tags against reverse()"""
+
+    def setUp(self):
+        post_urls._reverse.cache_clear()
+
+    def test_same_as_reverse(self):
+        cases = [
+            (post_urls.profile_url, 'profile', ('user.name-1',)),
+            (post_urls.group_url, 'group_posts', ('test_group',)),
+            (post_urls.post_url, 'post_view', ('testuser', 5)),
+            (post_urls.post_edit_url, 'post_edit', ('testuser', 5)),
+            (post_urls.add_comment_url, 'add_comment', ('@user+', 5)),
+            (post_urls.follow_url, 'profile_follow', ('testuser',)),
+            (post_urls.unfollow_url, 'profile_unfollow', ('testuser',)),
+        ]
+        for tag, view_name, args in cases:
+            for _ in range(2):
+                self.assertEqual(tag(*args), reverse(view_name, args=args))
+
+    def test_script_prefix(self):
+        expected = reverse('profile', args=['testuser'])
+        self.assertEqual(post_urls.profile_url('testuser'), expected)
+        set_script_prefix('/yatube/')
+        try:
+            self.assertEqual(post_urls.profile_url('testuser'),
+                             '/yatube' + expected)
+        finally:
+            set_script_prefix('/')
+        self.assertEqual(post_urls.profile_url('testuser'), expected)
+
+    def test_lru_cap(self):
+        maxsize = post_urls._reverse.cache_info().maxsize
+        for number in range(maxsize + 10):
+            post_urls.profile_url(f'user{number}')
+        self.assertEqual(post_urls._reverse.cache_info().currsize, maxsize)
+
+    def test_templates_render(self):
+        user = User.objects.create_user(username='testuser', password=12345)
+        post = Post.objects.create(text='test_text', author=user)
+        response = self.client.get(reverse('profile', args=['testuser']))
+        url = reverse('add_comment', args=['testuser', post.pk])
+        self.assertContains(response, f'href="{url}"')
+
+
+@override_settings(COMMENTS_PER_PAGE=5)
+class TestCommentPagination(QueryBudgetMixin, TestCase):
+    """Test for the cursor paginated comments of a post"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.post = Post.objects.create(text='test_text', author=self.user)
+        for number in range(12):
+            commenter = User.objects.create_user(username=f'user{number}',
+                                                 password=12345)
+            Comment.objects.create(post=self.post, author=commenter,
+                                   text=f'comment {number}')
+        kwargs = {'username': self.user.username, 'post_id': self.post.pk}
+        self.post_url = reverse('post_view', kwargs=kwargs)
+        self.comments_url = reverse('post_comments', kwargs=kwargs)
+
+    def texts(self, comments):
+        return [comment.text for comment in comments]
+
+    def test_first_page_on_post(self):
+        response = self.client.get(self.post_url)
+        comments = response.context['comments']
+        self.assertEqual(self.texts(comments),
+                         [f'comment {number}' for number in range(5)])
+        self.assertContains(response, f'data-url="{self.comments_url}'
+                                      f'?cursor={comments.next_cursor}"')
+
+        response = self.client.get(self.post_url,
+                                   {'comments': comments.next_cursor})
+        self.assertEqual(self.texts(response.context['comments']),
+                         [f'comment {number}' for number in range(5, 10)])
+
+    def test_fragment_endpoint(self):
+        cursor = self.client.get(self.post_url).context['comments'] \
+            .next_cursor
+        response = self.client.get(self.comments_url, {'cursor': cursor})
+        self.assertTemplateUsed(response, 'comment_list.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertContains(response, 'comment 5')
+        self.assertNotContains(response, 'comment 4')
+
+        data = self.client.get(self.comments_url,
+                               {'cursor': response.context['comments']
+                                .next_cursor, 'format': 'json'}).json()
+        self.assertEqual([comment['text'] for comment in data['comments']],
+                         ['comment 10', 'comment 11'])
+        self.assertEqual(data['comments'][0]['author'], 'user10')
+        self.assertIsNone(data['next_cursor'])
+
+    def test_query_count_does_not_grow(self):
+        # One of them for the conditional GET validators
+        response = self.assertQueryBudget(3, self.post_url)
+        for number in range(12, 40):
+            Comment.objects.create(post=self.post, author=self.user,
+                                   text=f'comment {number}')
+        self.assertQueryBudget(3, self.post_url)
+        self.assertQueryBudget(2, self.comments_url, {
+            'cursor': response.context['comments'].next_cursor})
+
+
+class TestApi(QueryBudgetMixin, TestCase):
+    """Test for the read-only JSON API"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group',
+                                          description='test')
+        self.posts = [
+            Post.objects.create(text=f'post {number}', author=self.user,
+                                group=self.group)
+            for number in range(25)
+        ]
+        Comment.objects.create(post=self.posts[0], author=self.user,
+                               text='test_comment')
+
+    def test_feed_pages(self):
+        data = self.client.get(reverse('api_post_list')).json()
+        self.assertEqual(len(data['results']), settings.API_PAGE_SIZE)
+        self.assertEqual(data['results'][0], {
+            'id': self.posts[-1].pk, 'text': 'post 24',
+            'pub_date': self.posts[-1].pub_date.isoformat(),
+            'author': 'testuser', 'group': 'test_group', 'image': None,
+            'comment_count': 0,
+        })
+        data = self.client.get(reverse('api_post_list'),
+                               {'cursor': data['next_cursor']}).json()
+        self.assertEqual([post['text'] for post in data['results']],
+                         [f'post {number}' for number in range(4, -1, -1)])
+        self.assertIsNone(data['next_cursor'])
+
+        url = reverse('api_group_post_list', kwargs={'slug': 'test_group'})
+        self.assertEqual(len(self.client.get(url).json()['results']),
+                         settings.API_PAGE_SIZE)
+        url = reverse('api_group_post_list', kwargs={'slug': 'missing'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_detail_comments_and_profile(self):
+        post = self.posts[0]
+        data = self.client.get(reverse('api_post_detail',
+                                       kwargs={'post_id': post.pk})).json()
+        self.assertEqual(data['comment_count'], 1)
+        data = self.client.get(reverse('api_comment_list',
+                                       kwargs={'post_id': post.pk})).json()
+        self.assertEqual(data['results'][0]['text'], 'test_comment')
+        data = self.client.get(reverse('api_profile',
+                                       kwargs={'username': 'testuser'}))
+        self.assertEqual(data.json()['posts_count'], 25)
+
+    def test_follow_feed(self):
+        url = reverse('api_follow_feed')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        reader = User.objects.create_user(username='reader',
+                                          password=12345)
+        self.client.force_login(reader)
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': 'testuser'}))
+        data = self.client.get(url).json()
+        self.assertEqual(data['results'][0]['text'], 'post 24')
+
+    def test_not_modified(self):
+        url = reverse('api_post_list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # The version comes from the cache
+        self.assertEqual(len(queries), 0)
+
+        # An edit keeps the newest pub_date but changes the ETag
+        self.posts[3].text = 'edited'
+        self.posts[3].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deleted_newest_post(self):
+        url = reverse('api_post_list')
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        # The newest pub_date moves back
+        Post.objects.order_by('-pub_date', '-pk').first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.json()['results'][0]['text'],
+                            'post 24')
+
+    def test_values_queries(self):
+        self.assertQueryBudget(2, reverse('api_post_list'))
+        self.assertQueryBudget(2, reverse('api_group_post_list',
+                                          kwargs={'slug': 'test_group'}))
+
+
+class TestConditionalGet(TestCase):
+    """Test for the ETag and Cache-Control of the pages"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.reader = User.objects.create_user(username='reader',
+                                               password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group',
+                                          description='test')
+        self.post = Post.objects.create(text='test_text', author=self.user,
+                                        group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group_posts', kwargs={'slug': 'test_group'}),
+            reverse('profile', kwargs={'username': 'testuser'}),
+            reverse('post_view', kwargs={'username': 'testuser',
+                                         'post_id': self.post.pk}),
+        ]
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304, url)
+        # The page itself is not built
+        self.assertLessEqual(len(queries), 1, url)
+
+    def test_not_modified(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertNotModified(url, response['ETag'])
+
+    def test_no_last_modified(self):
+        for url in self.urls:
+            self.assertNotIn('Last-Modified', self.client.get(url))
+        # An edit leaves every date alone
+        self.post.text = 'edited'
+        self.post.save()
+        for url in self.urls:
+            response = self.client.get(url,
+                                       HTTP_IF_MODIFIED_SINCE=http_date())
+            self.assertEqual(response.status_code, 200, url)
+            self.assertContains(response, 'edited')
+
+    def test_changes_make_new_etags(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='test_comment')
+        for url in self.urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 200, url)
+
+        url = reverse('profile', kwargs={'username': 'testuser'})
+        self.client.force_login(self.reader)
+        etag = self.client.get(url)['ETag']
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': 'testuser'}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Подписчиков: 1')
+
+    def test_changes_elsewhere_keep_etags(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Post.objects.create(text='other_text', author=self.reader)
+        index, *scoped = self.urls
+        response = self.client.get(index, HTTP_IF_NONE_MATCH=etags[index])
+        self.assertEqual(response.status_code, 200)
+        for url in scoped:
+            self.assertNotModified(url, etags[url])
+
+    def test_group_changes_make_new_etags(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        self.group.title = 'renamed_group'
+        self.group.save()
+        for url in self.urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertContains(response, 'renamed_group')
+
+        url = self.urls[1]
+        etag = self.client.get(url)['ETag']
+        self.post.group = None
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertNotContains(response, 'test_text')
+
+    def test_stale_fragment_not_kept(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        Post.objects.create(text='new_text', author=self.user)
+        lock_key = (make_template_fragment_key('index_page', ['1'])
+                    + ':rebuild')
+        cache.add(lock_key, 'rebuilding', 60)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertNotIn('s-maxage', response['Cache-Control'])
+        cache.delete(lock_key)
+        response = self.client.get(url)
+        self.assertContains(response, 'new_text')
+        self.assertNotModified(url, response['ETag'])
+
+    def test_viewer_is_part_of_etag(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.reader)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Пользователь: reader')
+
+    def test_cache_control(self):
+        response = self.client.get(self.urls[0])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn(f's-maxage={settings.PAGE_SHARED_MAX_AGE}',
+                      response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+        self.client.force_login(self.reader)
+        response = self.client.get(self.urls[0])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+
+class TestFeedCounts(TestCase):
+    """Test for the cached feed totals and the windowed page links"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group',
+                                          description='test')
+        self.other_group = Group.objects.create(title='other_group',
+                                                slug='other_group',
+                                                description='test')
+        for number in range(3):
+            Post.objects.create(text=f'post {number}', author=self.user,
+                                group=self.group)
+
+    def test_counts_follow_signals(self):
+        self.assertEqual(feed_counts.index_count(), 3)
+        self.assertEqual(feed_counts.group_count(self.group), 3)
+        with CaptureQueriesContext(connection) as queries:
+            post = Post.objects.create(text='new', author=self.user,
+                                       group=self.group)
+            self.assertEqual(feed_counts.index_count(), 4)
+            self.assertEqual(feed_counts.group_count(self.group), 4)
+        self.assertFalse([query for query in queries
+                          if 'COUNT' in query['sql']])
+
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(feed_counts.group_count(self.group), 3)
+        self.assertEqual(feed_counts.group_count(self.other_group), 1)
+        post.delete()
+        self.assertEqual(feed_counts.index_count(), 3)
+        self.assertEqual(feed_counts.group_count(self.other_group), 0)
+
+    @override_settings(FEED_COUNT_ESTIMATE=True)
+    def test_estimated_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(feed_counts.estimated_count(Post), 3)
+        self.assertEqual(feed_counts.index_count(), 3)
+
+    def test_page_window(self):
+        paginator = CursorPaginator(Post.objects.all(), 1, count=50)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(25)),
+            [1, paginator.ELLIPSIS, 23, 24, 25, 26, 27,
+             paginator.ELLIPSIS, 50])
+        self.assertEqual(list(paginator.get_elided_page_range(2)),
+                         [1, 2, 3, 4, paginator.ELLIPSIS, 50])
+
+        response = self.client.get(reverse('group_posts',
+                                           kwargs={'slug': 'test_group'}))
+        self.assertNotContains(response, '?page=')
+        for number in range(90):
+            Post.objects.create(text=f'more {number}', author=self.user)
+        response = self.client.get(reverse('index'), {'page': 2})
+        self.assertContains(response, 'href="?page=4"')
+        self.assertNotContains(response, 'href="?page=5"')
+        self.assertContains(response, 'href="?page=10"')
+        self.assertContains(response, paginator.ELLIPSIS)
+
+
+class TestObjectCache(TestCase):
+    """Test for the cached lookups of users, groups and posts"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group',
+                                          description='test')
+        self.post = Post.objects.create(text='test_text', author=self.user,
+                                        group=self.group)
+
+    def test_lookups_are_cached(self):
+        user_cache.get('testuser')
+        group_cache.get('test_group')
+        post_cache.get(self.post.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_cache.get('testuser'), self.user)
+            self.assertEqual(group_cache.get('test_group'), self.group)
+            self.assertEqual(post_cache.get(self.post.pk).text,
+                             'test_text')
+
+    def test_missing_rows_are_cached(self):
+        self.assertIsNone(user_cache.get('nobody'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/nobody/').status_code, 404)
+        User.objects.create_user(username='nobody', password=12345)
+        self.assertIsNotNone(user_cache.get('nobody'))
+
+    def test_users_cached_without_credentials(self):
+        user_cache.get('testuser')
+        cached = cache.get(user_cache.key('testuser'))
+        self.assertEqual(cached.username, 'testuser')
+        for field in ('password', 'email', 'is_staff', 'last_login'):
+            self.assertNotIn(field, cached.__dict__)
+
+    def test_saves_invalidate(self):
+        post_cache.get(self.post.pk)
+        self.post.text = 'edited'
+        self.post.save()
+        self.assertEqual(post_cache.get(self.post.pk).text, 'edited')
+
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='test_comment')
+        self.assertEqual(post_cache.get(self.post.pk).comment_count, 1)
+
+        user_cache.get('testuser')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertIsNone(user_cache.get('testuser'))
+        self.assertEqual(user_cache.get('renamed').pk, self.user.pk)
+
+        group_cache.get('test_group')
+        self.group.delete()
+        self.assertIsNone(group_cache.get('test_group'))
+
+    def test_post_of_another_author(self):
+        other = User.objects.create_user(username='other', password=12345)
+        response = self.client.get(reverse(
+            'post_view', kwargs={'username': other.username,
+                                 'post_id': self.post.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class TestPostDetailQueries(QueryBudgetMixin, TestCase):
+    """Test that post pages load in a fixed number of queries"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        group = Group.objects.create(title='test_group', slug='test_group',
+                                     description='test')
+        self.post = Post.objects.create(text='test_text', author=self.user,
+                                        group=group)
+        # Every comment has its own author to expose N+1 queries
+        for number in range(10):
+            commenter = User.objects.create_user(username=f'user{number}')
+            Follow.objects.create(user=commenter, author=self.user)
+            Comment.objects.create(post=self.post, author=commenter,
+                                   text=f'comment {number}')
+        self.kwargs = {'username': 'testuser', 'post_id': self.post.pk}
+
+    def test_post_view(self):
+        # Validators, the post with author, stats and group, comments
+        response = self.assertQueryBudget(
+            3, reverse('post_view', kwargs=self.kwargs))
+        self.assertContains(response, 'test_group')
+        self.assertContains(response, 'Подписчиков: 10')
+        self.assertContains(response, 'comment 9')
+
+    def test_add_comment_form(self):
+        self.client.force_login(self.user)
+        # The session and user, then the same two as post_view
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('add_comment', kwargs=self.kwargs), {'text': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 4)
+        self.assertContains(response, 'comment 9')
+
+    def test_other_author(self):
+        response = self.client.get(reverse(
+            'post_view', kwargs={'username': 'user0',
+                                 'post_id': self.post.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestPageCache(QueryBudgetMixin, TestCase):
+    """Test for the cached page shells and their per viewer holes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser',
+                                             password=12345)
+        self.reader = User.objects.create_user(username='reader',
+                                               password=12345)
+        self.group = Group.objects.create(title='test_group',
+                                          slug='test_group',
+                                          description='test')
+        self.post = Post.objects.create(text='test_text', author=self.user,
+                                        group=self.group)
+        self.post_url = reverse('post_view',
+                                kwargs={'username': 'testuser',
+                                        'post_id': self.post.pk})
+        self.profile_url = reverse('profile',
+                                   kwargs={'username': 'testuser'})
+        self.urls = [
+            reverse('index'),
+            reverse('group_posts', kwargs={'slug': 'test_group'}),
+            self.profile_url,
+            self.post_url,
+        ]
+
+    def test_cached_page(self):
+        for url in self.urls:
+            self.client.get(url)
+            # Only the validators
+            response = self.assertQueryBudget(1, url)
+            self.assertContains(response, 'test_text')
+            self.assertNotContains(response, '\x00')
+
+    def test_shell_shared_by_viewers(self):
+        for url in self.urls:
+            self.assertNotContains(self.client.get(url), 'Редактировать')
+        self.client.force_login(self.user)
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertContains(response, 'Пользователь: testuser')
+            self.assertContains(response, 'Редактировать')
+        self.client.force_login(self.reader)
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertContains(response, 'Пользователь: reader')
+            self.assertNotContains(response, 'Редактировать')
+
+    def test_comment_form(self):
+        self.client.get(self.post_url)
+        self.assertNotContains(self.client.get(self.post_url),
+                               'csrfmiddlewaretoken')
+        self.client.force_login(self.reader)
+        self.assertContains(self.client.get(self.post_url),
+                            'csrfmiddlewaretoken')
+
+    def test_follow_button(self):
+        self.client.force_login(self.reader)
+        self.assertContains(self.client.get(self.profile_url), 'Подписаться')
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': 'testuser'}))
+        self.assertContains(self.client.get(self.profile_url), 'Отписаться')
+
+    def test_stale_fragment_not_cached(self):
+        url = self.urls[0]
+        self.client.get(url)
+        Post.objects.create(text='new_text', author=self.user)
+        # Another worker is rebuilding the fragment
+        lock_key = (make_template_fragment_key('index_page', ['1'])
+                    + ':rebuild')
+        cache.add(lock_key, 'rebuilding', 60)
+        self.assertNotContains(self.client.get(url), 'new_text')
+        cache.delete(lock_key)
+        self.assertContains(self.client.get(url), 'new_text')
+
+    def test_nul_in_query(self):
+        forged = '\x00' + '0' * 16 + ':["nav", {}]\x00'
+        for query in ('\x00\x00', '\x001\x00', '\x00["x"]\x00', forged):
+            for url in (reverse('post_search'), self.urls[0]):
+                response = self.client.get(url, {'q': query})
+                self.assertEqual(response.status_code, 200, url)
+
+    def test_fill_checks_nonce(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        own = page_cache.marker(request, 'nav', {}).encode()
+        forged = page_cache.MARKER.format(
+            nonce='0' * 16, payload='["nav", {}]').encode()
+        self.assertEqual(page_cache.fill(forged, request), forged)
+        filled = page_cache.fill(own + forged, request)
+        self.assertIn(b'href="/auth/login/"', filled)
+        self.assertTrue(filled.endswith(forged))
+
+    def test_changes_make_new_page(self):
+        self.client.get(self.post_url)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='test_comment')
+        self.assertContains(self.client.get(self.post_url), 'test_comment')
+
+
+class TestAdmin(QueryBudgetMixin, TestCase):
+    """Test that the admin changelists scale with the number of rows"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password=12345)
+        self.client.force_login(self.admin)
+        for number in range(10):
+            author = User.objects.create_user(username=f'user{number}')
+            post = Post.objects.create(text=f'text {number}', author=author)
+            Comment.objects.create(post=post, author=author, text='comment')
+            Follow.objects.create(user=author, author=self.admin)
+
+    def test_changelists(self):
+        # The session, the user, the table statistics, the count and the
+        # rows, for posts also the first and the last pub_date
+        budgets = {'post': 7, 'comment': 5, 'follow': 5}
+        for model, budget in budgets.items():
+            url = reverse(f'admin:posts_{model}_changelist')
+            response = self.assertQueryBudget(budget, url)
+            self.assertContains(response, 'user9')
+
+    def test_follow_filters_without_users(self):
+        response = self.client.get(reverse('admin:posts_follow_changelist'),
+                                   {'q': 'user3'})
+        self.assertNotContains(response, 'user4')
+        self.assertNotContains(response, 'author__id__exact')
+
+    def test_count_estimated(self):
+        url = reverse('admin:posts_post_changelist')
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=5), \
+                mock.patch('posts.paginator.estimated_count',
+                           return_value=10 ** 6):
+            self.assertContains(self.client.get(url), '1000000')
+            # Filtered totals are counted up to the limit
+            response = self.client.get(url, {'author__id__exact': 2})
+            self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_count_without_statistics(self):
+        url = reverse('admin:posts_post_changelist')
+        top = Post.objects.order_by('-pk').values_list('pk', flat=True)[0]
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=5), \
+                mock.patch('posts.paginator.estimated_count',
+                           return_value=None):
+            response = self.client.get(url)
+        self.assertEqual(response.context['cl'].result_count, top)
+
+    def test_date_hierarchy_without_distinct(self):
+        url = reverse('admin:posts_post_changelist')
+        Post.objects.filter(text='text 0').update(
+            pub_date=datetime.datetime(2019, 3, 5, tzinfo=timezone.utc))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse(any('DISTINCT' in query['sql']
+                             for query in queries))
+        year = timezone.now().year
+        for shown in range(2019, year + 1):
+            self.assertContains(response, f'pub_date__year={shown}')
+        # Drilling down narrows the links to the months of the year
+        response = self.client.get(url, {'pub_date__year': 2019})
+        self.assertContains(response, 'pub_date__month=3')
+        self.assertNotContains(response, 'pub_date__month=4')
+        response = self.client.get(url, {'pub_date__year': 2019,
+                                         'pub_date__month': 3})
+        self.assertContains(response, 'pub_date__day=5')
+        self.assertNotContains(response, 'pub_date__day=6')
@@ -0,0 +1,289 @@
+"""Thumbnail generation off the request path.
+
+PregeneratingBackend replaces sorl-thumbnail's backend: it returns a
+thumbnail only when it is already in the key-value store, otherwise it
+queues the work to a thread pool and returns a placeholder, so no request
+pays for decoding and resizing an upload. new_post and post_edit queue
+every variant (see variants) as soon as the image is saved; the pool
+gets the work once the transaction commits. Once the last variant of an
+image is stored its posts are marked thumbnails_ready, which gives their
+cards a new key, and the cached feed fragments are invalidated.
+
+Worker threads write the key-value store and read posts on connections
+of their own. KVStore and image_ready take those database writes one at
+a time, so on SQLite, which takes a single writer, the workers don't
+contend with each other. With THUMBNAIL_WORKERS = 0 there is no pool:
+thumbnails are made inline where they are needed, and a page render
+gets the thumbnail it just made rather than a placeholder.
+
+ResponsiveImage collects the ready variants of an image into the
+srcset attributes post_item.html renders.
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from PIL import features
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import DummyImageFile, ImageFile
+from sorl.thumbnail.kvstores import cached_db_kvstore
+
+from posts import feed_cache
+from posts.cache import post_cache
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_SVG = (
+    "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' "
+    "width='{width}' height='{height}'%3E%3Crect width='100%25' "
+    "height='100%25' fill='%23e9ecef'/%3E%3C/svg%3E"
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+# Held by the threads of this process while they write the database
+_db_lock = threading.Lock()
+
+
+class Placeholder(DummyImageFile):
+    """Stands in for a thumbnail that is still being generated."""
+
+    @property
+    def url(self):
+        return PLACEHOLDER_SVG.format(width=self.x, height=self.y)
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """sorl's database key-value store, written one thread at a time."""
+
+    def _set_raw(self, key, value):
+        with _db_lock:
+            super()._set_raw(key, value)
+
+    def _delete_raw(self, *keys):
+        with _db_lock:
+            super()._delete_raw(*keys)
+
+
+class PregeneratingBackend(ThumbnailBackend):
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        source = ImageFile(file_)
+        options = self.full_options(source, options)
+        cached = self.stored(source, geometry_string, options)
+        if cached:
+            return cached
+        if source.exists():
+            made = enqueue(source.name, geometry_string, options)
+            # Only made already without a pool
+            if made.done() and made.result():
+                return made.result()
+        return Placeholder(geometry_string)
+
+    def stored(self, source, geometry_string, options):
+        """The thumbnail from the key-value store, None if not made yet.
+
+        options must be complete, see full_options.
+        """
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+    def generate(self, file_, geometry_string, **options):
+        """Render the thumbnail now, like the stock backend does."""
+        return super().get_thumbnail(file_, geometry_string, **options)
+
+    def full_options(self, source, options):
+        # The same defaults ThumbnailBackend.get_thumbnail applies, so the
+        # thumbnail name matches the one the worker will store
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def variants_ready(name):
+    """True once every variant of the image is stored."""
+    backend = PregeneratingBackend()
+    source = ImageFile(name)
+    return all(
+        backend.stored(source, geometry_string,
+                       backend.full_options(source, options))
+        for geometry_string, options in variants())
+
+
+def image_ready(name):
+    """Mark the posts of an image whose variants are all stored.
+
+    Their cards get a new key (see feed_cache.card_key) and the cached
+    feed fragments and pages that may show the placeholder are rebuilt.
+    """
+    with _db_lock:
+        posts = list(Post.objects.filter(image=name)
+                     .values_list('pk', 'author_id', 'group_id'))
+        Post.objects.filter(image=name).update(thumbnails_ready=True)
+    if not posts:
+        return
+    post_cache.invalidate(*(pk for pk, _, _ in posts))
+    feed_cache.invalidate_index()
+    feed_cache.invalidate_scopes(*{scope for row in posts
+                                   for scope in feed_cache.post_scopes(*row)})
+    for author_id in {author_id for _, author_id, _ in posts}:
+        feed_cache.invalidate_author(author_id)
+
+
+def _generate(name, geometry_string, options, job, in_worker=True):
+    """Make one thumbnail, returns it or None if it could not be made."""
+    try:
+        thumbnail = PregeneratingBackend().generate(name, geometry_string,
+                                                    **options)
+        # Only the last variant made finds them all ready
+        if variants_ready(name):
+            image_ready(name)
+        return thumbnail
+    except Exception:
+        logger.exception('Could not make a %s thumbnail of %s',
+                         geometry_string, name)
+        return None
+    finally:
+        with _executor_lock:
+            _pending.discard(job)
+        if in_worker:
+            # Worker threads don't go through request_finished
+            connection.close()
+
+
+def _claim(job):
+    """False if the same thumbnail is already being made."""
+    with _executor_lock:
+        if job in _pending:
+            return False
+        _pending.add(job)
+        return True
+
+
+def enqueue(name, geometry_string, options):
+    """Queue one thumbnail, returns a Future of it (None if it was already
+    being made or could not be made).
+
+    With THUMBNAIL_WORKERS = 0 the thumbnail is made right away, otherwise
+    it is handed to the pool when the current transaction commits: the
+    worker's connection would not see the post before.
+    """
+    job = (name, geometry_string, tuple(sorted(options.items())))
+    future = Future()
+    if not settings.THUMBNAIL_WORKERS:
+        thumbnail = None
+        if _claim(job):
+            thumbnail = _generate(name, geometry_string, options, job,
+                                  in_worker=False)
+        future.set_result(thumbnail)
+        return future
+
+    def submit():
+        if not _claim(job):
+            future.set_result(None)
+            return
+        done = _get_executor().submit(_generate, name, geometry_string,
+                                      options, job)
+        done.add_done_callback(lambda done: future.set_result(done.result()))
+
+    transaction.on_commit(submit)
+    return future
+
+
+def variants():
+    """(geometry, options) of every stored variant of a post image."""
+    aspect_width, aspect_height = settings.POST_IMAGE_ASPECT
+    formats = [image_format
+               for image_format in settings.POST_IMAGE_VARIANT_FORMATS
+               if image_format != 'WEBP' or features.check('webp')]
+    for width in settings.POST_IMAGE_VARIANT_WIDTHS:
+        height = round(width * aspect_height / aspect_width)
+        for image_format in formats:
+            yield f'{width}x{height}', {'crop': 'center', 'upscale': True,
+                                        'format': image_format}
+
+
+def pregenerate(post):
+    """Queue every variant of the post's newly uploaded image."""
+    if not post.image:
+        return []
+    if post.thumbnails_ready:
+        # Still set for the replaced image
+        Post.objects.filter(pk=post.pk).update(thumbnails_ready=False)
+        post.thumbnails_ready = False
+    return [enqueue(post.image.name, geometry_string, options)
+            for geometry_string, options in variants()]
+
+
+class ResponsiveImage:
+    """The ready variants of a post image, grouped by format."""
+
+    def __init__(self, image):
+        self.placeholder = None
+        self.sources = {}
+        for geometry_string, options in variants():
+            thumbnail = default.backend.get_thumbnail(
+                image, geometry_string, **options)
+            if isinstance(thumbnail, DummyImageFile):
+                self.placeholder = thumbnail
+                continue
+            self.sources.setdefault(options['format'], []).append(thumbnail)
+
+    def _srcset(self, image_format):
+        return ', '.join(f'{thumbnail.url} {thumbnail.width}w'
+                         for thumbnail in self.sources.get(image_format, []))
+
+    @property
+    def srcset(self):
+        return self._srcset('JPEG')
+
+    @property
+    def webp_srcset(self):
+        return self._srcset('WEBP')
+
+    @property
+    def fallback(self):
+        # The widest JPEG, or the placeholder while none is ready
+        for thumbnails in (self.sources.get('JPEG'),
+                           *self.sources.values()):
+            if thumbnails:
+                return thumbnails[-1]
+        return self.placeholder
+
+    @property
+    def src(self):
+        return self.fallback.url
+
+    @property
+    def width(self):
+        return self.fallback.width
+
+    @property
+    def height(self):
+        return self.fallback.height
@@ -0,0 +1,131 @@
+"""Materialized follow feed.
+
+Every new post is pushed (fan-out-on-write) into a TimelineEntry row for
+each follower, so follow_index reads a page from a single indexed table
+instead of joining Post against the user's follows. Authors who once had
+more than TIMELINE_FANOUT_LIMIT followers are marked fan_out_on_read for
+good: their posts are merged into the feed at read time
+(fan-out-on-read), even after they lose followers, so no post is ever
+left out of both the timelines and the merge.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, OuterRef, Q, Subquery
+
+from posts.models import Follow, Post, TimelineEntry, UserStats
+
+CELEBRITIES_KEY = 'timeline:celebrities:{user_id}'
+# CursorPaginator arguments for the posts of feed()
+FEED_ORDER = {'cursor_field': 'feed_date', 'pk_field': 'feed_pk'}
+
+
+def follower_ids(author_id):
+    """Up to TIMELINE_FANOUT_LIMIT + 1 ids of the author's followers."""
+    return list(Follow.objects.filter(author_id=author_id)
+                .values_list('user_id', flat=True)
+                [:settings.TIMELINE_FANOUT_LIMIT + 1])
+
+
+def is_celebrity(author_id):
+    """True if the author's posts are read on demand."""
+    return UserStats.objects.filter(user_id=author_id,
+                                    fan_out_on_read=True).exists()
+
+
+def mark_celebrity(author_id):
+    """Switch an author past TIMELINE_FANOUT_LIMIT followers to
+    fan-out-on-read, called whenever the author gains a follower."""
+    marked = (UserStats.objects
+              .filter(user_id=author_id, fan_out_on_read=False,
+                      followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+              .update(fan_out_on_read=True))
+    if marked:
+        # Their followers must start reading the author's posts now
+        cache.delete_many(
+            [CELEBRITIES_KEY.format(user_id=user_id)
+             for user_id in Follow.objects.filter(author_id=author_id)
+             .values_list('user_id', flat=True).iterator()])
+
+
+def push_post(post):
+    """Add a freshly created post to the timelines of its followers."""
+    if is_celebrity(post.author_id):
+        return
+    user_ids = follower_ids(post.author_id)
+    if len(user_ids) > settings.TIMELINE_FANOUT_LIMIT:
+        # Counters out of date, recount_user_stats repairs them
+        return
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post.pk,
+                       pub_date=post.pub_date)
+         for user_id in user_ids],
+        batch_size=500, ignore_conflicts=True,
+    )
+    trim(*user_ids)
+
+
+def backfill(user, author):
+    """Copy the recent posts of a newly followed author into a timeline."""
+    cache.delete(CELEBRITIES_KEY.format(user_id=user.pk))
+    if is_celebrity(author.pk):
+        return
+    posts = (Post.objects.filter(author=author)
+             .order_by('-pub_date', '-pk')
+             .values_list('pk', 'pub_date')[:settings.TIMELINE_SIZE])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user=user, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in posts],
+        batch_size=500, ignore_conflicts=True,
+    )
+    trim(user.pk)
+
+
+def purge(user, author):
+    """Drop an unfollowed author's posts from a timeline."""
+    cache.delete(CELEBRITIES_KEY.format(user_id=user.pk))
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def trim(*user_ids):
+    """Keep at most TIMELINE_SIZE newest entries in each timeline, with a
+    DELETE per 500 timelines."""
+    cutoff = (TimelineEntry.objects.filter(user=OuterRef('user'))
+              .order_by('-pub_date', '-post')
+              .values('pub_date')
+              [settings.TIMELINE_SIZE:settings.TIMELINE_SIZE + 1])
+    for start in range(0, len(user_ids), 500):
+        TimelineEntry.objects.filter(
+            user_id__in=user_ids[start:start + 500],
+            pub_date__lte=Subquery(cutoff),
+        ).delete()
+
+
+def followed_celebrities(user):
+    """Ids of the followed authors whose posts are read on demand."""
+    key = CELEBRITIES_KEY.format(user_id=user.pk)
+    author_ids = cache.get(key)
+    if author_ids is None:
+        author_ids = list(
+            Follow.objects
+            .filter(user=user, author__stats__fan_out_on_read=True)
+            .values_list('author', flat=True)
+        )
+        cache.set(key, author_ids, settings.TIMELINE_CELEBRITIES_TTL)
+    return author_ids
+
+
+def feed(user):
+    """Posts of the user's follow feed, to be paged with FEED_ORDER.
+
+    Without followed celebrities feed_date and feed_pk come from the
+    timeline entries, so pages are read from their index.
+    """
+    celebrities = followed_celebrities(user)
+    if not celebrities:
+        return (Post.objects.filter(timeline_entries__user=user)
+                .annotate(feed_date=F('timeline_entries__pub_date'),
+                          feed_pk=F('timeline_entries__post')))
+    return (Post.objects.filter(Q(timeline_entries__user=user)
+                                | Q(author__in=celebrities))
+            .annotate(feed_date=F('pub_date'), feed_pk=F('pk'))
+            .distinct())
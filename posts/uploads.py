@@ -0,0 +1,88 @@
+"""Bounded-memory processing of uploaded post images.
+
+The header is checked first. JPEGs are decoded straight to a reduced
+size (draft mode), up to POST_IMAGE_MAX_PIXELS. Pillow has no such mode
+for the other formats: they are decoded at full size and then shrunk,
+so they are refused past the lower POST_IMAGE_MAX_DECODED_PIXELS. The
+result is rotated by its EXIF orientation, stripped of metadata,
+re-encoded as a compact JPEG (PNG when it has transparency) and spooled
+to a temporary file which the storage then copies to MEDIA_ROOT in
+chunks.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from PIL import Image, ImageOps
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP', 'BMP')
+# Formats Pillow can decode at a reduced size
+DRAFT_FORMATS = ('JPEG',)
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class ImageTooLarge(InvalidImage):
+    pass
+
+
+def open_downsampled(file, max_size):
+    """Open an image and downsample it to max_size.
+
+    Only the header is read before the size checks. JPEGs are loaded at
+    no more than ~2x max_size, other formats at full size.
+    """
+    file.seek(0)
+    try:
+        image = Image.open(file)
+    except (OSError, SyntaxError, ValueError):
+        raise InvalidImage
+    if image.format not in ALLOWED_FORMATS:
+        raise InvalidImage
+    width, height = image.size
+    if image.format in DRAFT_FORMATS:
+        max_pixels = settings.POST_IMAGE_MAX_PIXELS
+    else:
+        max_pixels = settings.POST_IMAGE_MAX_DECODED_PIXELS
+    if width * height > max_pixels:
+        raise ImageTooLarge
+    if image.format in DRAFT_FORMATS:
+        # The decoder scales by 1/2, 1/4 or 1/8 without a full size buffer
+        image.draft('RGB', max_size)
+    try:
+        image.thumbnail(max_size, Image.LANCZOS, reducing_gap=2.0)
+    except (OSError, SyntaxError, ValueError):
+        raise InvalidImage
+    return image
+
+
+def compact_image(upload):
+    """Return a downsampled, metadata-free re-encoding of an upload."""
+    max_size = settings.POST_IMAGE_MAX_SIZE
+    image = open_downsampled(upload, max_size)
+    image = ImageOps.exif_transpose(image)
+
+    has_alpha = (image.mode in ('RGBA', 'LA')
+                 or 'transparency' in image.info)
+    mode = 'RGBA' if has_alpha else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+    if has_alpha:
+        image_format, extension = 'PNG', 'png'
+        options = {'optimize': True}
+    else:
+        image_format, extension = 'JPEG', 'jpg'
+        options = {'quality': settings.POST_IMAGE_QUALITY,
+                   'optimize': True, 'progressive': True}
+
+    output = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    # Nothing from image.info (EXIF, ICC, comments) is passed on
+    image.save(output, image_format, **options)
+    output.seek(0)
+
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    return File(output, name=f'{stem}.{extension}')
@@ -1,17 +1,31 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('group/<slug:slug>/', views.group_posts, name='group_posts'),
     path('new/', views.new_post, name='new_post'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.post_search, name='post_search'),
+    path('api/v1/posts/', api.post_list, name='api_post_list'),
+    path('api/v1/posts/<int:post_id>/', api.post_detail,
+         name='api_post_detail'),
+    path('api/v1/posts/<int:post_id>/comments/', api.comment_list,
+         name='api_comment_list'),
+    path('api/v1/groups/<slug:slug>/posts/', api.group_post_list,
+         name='api_group_post_list'),
+    path('api/v1/users/<username>/', api.profile, name='api_profile'),
+    path('api/v1/users/<username>/posts/', api.profile_post_list,
+         name='api_profile_post_list'),
+    path('api/v1/follow/', api.follow_feed, name='api_follow_feed'),
     path('<username>/', views.profile, name='profile'),
     path('<username>/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('<username>/<int:post_id>', views.post_view, name='post_view'),
     path("<username>/<int:post_id>/comment/", views.add_comment,
          name="add_comment"),
+    path('<username>/<int:post_id>/comments/', views.post_comments,
+         name='post_comments'),
     path("<username>/follow/", views.profile_follow, name="profile_follow"),
     path("<username>/unfollow/", views.profile_unfollow,
          name="profile_unfollow"),
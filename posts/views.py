@@ -1,28 +1,61 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 
-from posts.forms import PostForm, CommentForm
-from posts.models import Post, Group, User, Follow
+from posts import feed_cache, feed_counts, search, thumbnails, timeline
+from posts.cache import group_cache, post_cache, user_cache
+from posts.conditional import conditional, page_cache_control
+from posts.forms import PostForm, CommentForm, SearchForm
+from posts.page_cache import full_page_cache
+from posts.models import Post, User, Follow, UserStats
+from posts.paginator import CursorPaginator
 
+# What the author card of profile.html and post.html shows
+AUTHOR_CARD = ('first_name', 'last_name', 'stats__followers_count',
+               'stats__following_count', 'stats__posts_count')
 
+
+def index_validators(request):
+    return feed_cache.index_generation()
+
+
+@page_cache_control
+@conditional(index_validators, per_viewer=True)
+@full_page_cache
 def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    # Take a page number from the request, and let paginator know what page
-    # we want to see
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.select_related('author', 'group')
+    paginator = CursorPaginator(post_list, 10,
+                                count=feed_counts.index_count)
+    # Take a cursor (or a legacy page number) from the request, and let
+    # paginator know what page we want to see
+    page = paginator.get_page(request.GET.get('page'),
+                              cursor=request.GET.get('cursor'))
     return render(request, 'index.html',
-                  {'page': page, 'paginator': paginator})
+                  {'page': page,
+                   'paginator': paginator,
+                   'index_generation': feed_cache.index_generation(),
+                   'cache_timeout': settings.INDEX_CACHE_TIMEOUT})
 
 
+def group_posts_validators(request, slug):
+    group = group_cache.get(slug)
+    if group is None:
+        return None
+    return feed_cache.scoped_generation(f'group:{group.pk}')
+
+
+@page_cache_control
+@conditional(group_posts_validators, per_viewer=True)
+@full_page_cache
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.group_posts.order_by('-pub_date')
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    group = group_cache.get_or_404(slug)
+    post_list = group.group_posts.select_related('author', 'group')
+    paginator = CursorPaginator(
+        post_list, 10, count=lambda: feed_counts.group_count(group))
+    page = paginator.get_page(request.GET.get('page'),
+                              cursor=request.GET.get('cursor'))
     return render(request, 'group.html',
                   {'group': group, 'page': page, 'paginator': paginator})
 
@@ -35,48 +68,133 @@ def new_post(request):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            thumbnails.pregenerate(post)
             return redirect('index')
     form = PostForm()
     return render(request, 'new_post.html', {'form': form})
 
 
+def profile_validators(request, username):
+    if user_cache.known_missing(username):
+        return None
+    row = (User.objects.filter(username=username)
+           .values_list('pk', *AUTHOR_CARD).first())
+    if row is None:
+        return None
+    author_id, *author_card = row
+    # Follows change the counters but not the generation
+    return (f'{feed_cache.scoped_generation(f"author:{author_id}")}'
+            f'|{author_card}')
+
+
+@page_cache_control
+@conditional(profile_validators, per_viewer=True)
+@full_page_cache
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.author_posts.order_by('-pub_date')
-    paginator = Paginator(post_list, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = user_cache.get_or_404(username)
+    stats = UserStats.for_user(author)
+    post_list = author.author_posts.select_related('author', 'group')
+    paginator = CursorPaginator(post_list, 5, count=stats.posts_count)
+    page = paginator.get_page(request.GET.get('page'),
+                              cursor=request.GET.get('cursor'))
     item_dict = {
         'author': author,
+        'stats': stats,
         'page': page,
         'paginator': paginator,
 
     }
-    if not request.user.is_anonymous:
-        following = Follow.objects.filter(user=request.user,
-                                          author=author).exists()
-        item_dict['following'] = following
-
     return render(request, "profile.html", item_dict
                   )
 
 
+def author_post_or_404(author, post_id):
+    """The author's post, both from the object cache."""
+    post = post_cache.get_or_404(post_id)
+    if post.author_id != author.pk:
+        raise Http404('No Post matches the given query.')
+    post.author = author
+    return post
+
+
+def comments_page(request, post, cursor_param):
+    """A page of the post's comments, oldest first, with their authors."""
+    comment_list = post.post_comments.select_related('author')
+    paginator = CursorPaginator(comment_list, settings.COMMENTS_PER_PAGE,
+                                cursor_field='created', descending=False)
+    return paginator.get_page(None, cursor=request.GET.get(cursor_param))
+
+
+def load_post_detail(request, username, post_id):
+    """Everything post.html shows but the form, in two queries.
+
+    The post comes joined with its author, the author's stats and its
+    group, then the first page of comments with their authors.
+    """
+    if (user_cache.known_missing(username)
+            or post_cache.known_missing(post_id)):
+        raise Http404('No Post matches the given query.')
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        pk=post_id, author__username=username)
+    return {'post': post,
+            'author': post.author,
+            'stats': UserStats.for_user(post.author),
+            'comments': comments_page(request, post, 'comments')}
+
+
+def post_view_validators(request, username, post_id):
+    if (user_cache.known_missing(username)
+            or post_cache.known_missing(post_id)):
+        return None
+    row = (Post.objects.filter(pk=post_id, author__username=username)
+           .values_list('group_id',
+                        *(f'author__{field}' for field in AUTHOR_CARD))
+           .first())
+    if row is None:
+        return None
+    group_id, *author_card = row
+    # The group shows its title
+    scopes = [f'post:{post_id}']
+    if group_id is not None:
+        scopes.append(f'group:{group_id}')
+    return f'{feed_cache.scoped_generation(*scopes)}|{author_card}'
+
+
+@page_cache_control
+@conditional(post_view_validators, per_viewer=True)
+@full_page_cache
 def post_view(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(Post, author=author, pk=post_id)
-    comments = post.post_comments.all()
-
-    form = CommentForm()
-    return render(request, 'post.html',
-                  {'post': post,
-                   'author': author,
-                   'form': form,
-                   'comments': comments})
+    context = load_post_detail(request, username, post_id)
+    context['form'] = CommentForm()
+    return render(request, 'post.html', context)
+
+
+def post_comments(request, username, post_id):
+    """The next comments of a post: an HTML fragment for the "more" link
+    of post.html, or JSON with ?format=json."""
+    post = get_object_or_404(Post.objects.select_related('author'),
+                             author__username=username, pk=post_id)
+    comments = comments_page(request, post, 'cursor')
+    if request.GET.get('format') != 'json':
+        return render(request, 'comment_list.html',
+                      {'post': post, 'comments': comments})
+    return JsonResponse({
+        'comments': [
+            {'id': comment.pk,
+             'author': comment.author.username,
+             'text': comment.text,
+             'created': comment.created.isoformat()}
+            for comment in comments
+        ],
+        'next_cursor': comments.next_cursor,
+    })
 
 
 @login_required
 def post_edit(request, username, post_id):
-    author = get_object_or_404(User, username=username)
+    author = user_cache.get_or_404(username)
+    # Read from the database: the form saves it back
     post = get_object_or_404(Post, pk=post_id, author=author)
 
     if request.user != author:
@@ -88,7 +206,9 @@ def post_edit(request, username, post_id):
 
     if request.method == "POST":
         if form.is_valid():
-            form.save()
+            post = form.save()
+            if 'image' in form.changed_data:
+                thumbnails.pregenerate(post)
             return redirect("post_view", username=request.user.username,
                             post_id=post_id)
 
@@ -110,13 +230,11 @@ def server_error(request):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    author = get_object_or_404(User, username=username)
-    comments = post.post_comments.all()
-
     form = CommentForm(request.POST or None)
     if request.method == 'POST':
         if form.is_valid():
+            post = author_post_or_404(user_cache.get_or_404(username),
+                                      post_id)
             new_comment = form.save(commit=False)
             new_comment.author = request.user
             new_comment.post = post
@@ -124,42 +242,73 @@ def add_comment(request, username, post_id):
             return redirect('post_view', username=username,
                             post_id=post_id)
 
-    return render(request, 'post.html',
-                  {'post': post,
-                   'author': author,
-                   'form': form,
-                   'comments': comments})
+    context = load_post_detail(request, username, post_id)
+    context['form'] = form
+    return render(request, 'post.html', context)
 
 
 @login_required
 def follow_index(request):
     user = request.user
-    followed_authors = user.follower.all().values('author')
-
-    # Create a list of posts to paginate
-    post_list = Post.objects.filter(author__in=followed_authors).order_by(
-        '-pub_date')
-
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    # Posts are pushed to the user's timeline when they are published
+    post_list = timeline.feed(user).select_related('author', 'group')
+    feed_version = feed_cache.feed_version(user)
+
+    paginator = CursorPaginator(
+        post_list, 10,
+        count=lambda: feed_counts.follow_count(user, feed_version,
+                                               post_list),
+        **timeline.FEED_ORDER)
+    page = paginator.get_page(request.GET.get('page'),
+                              cursor=request.GET.get('cursor'))
     return render(request, 'follow.html',
-                  {'page': page, 'paginator': paginator})
+                  {'page': page,
+                   'paginator': paginator,
+                   'feed_version': feed_version,
+                   'cache_timeout': settings.FOLLOW_FEED_CACHE_TIMEOUT})
+
+
+def post_search(request):
+    form = SearchForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'search.html', {'form': form})
+
+    # Ids of up to SEARCH_MAX_RESULTS matches, best first
+    post_ids = search.search(form.cleaned_data['q'],
+                             group=form.cleaned_data['group'],
+                             author=form.cleaned_data['author'])
+    paginator = Paginator(post_ids, 10)
+    page = paginator.get_page(request.GET.get('page'))
+    posts = (Post.objects.select_related('author', 'group')
+             .in_bulk(page.object_list))
+    page.object_list = [posts[pk] for pk in page.object_list if pk in posts]
+
+    query = request.GET.copy()
+    query.pop('page', None)
+    return render(request, 'search.html',
+                  {'form': form,
+                   'page': page,
+                   'paginator': paginator,
+                   'query': query.urlencode()})
 
 
 @login_required
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = user_cache.get_or_404(username)
     if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        _, created = Follow.objects.get_or_create(user=request.user,
+                                                  author=author)
+        if created:
+            timeline.backfill(request.user, author)
 
     return redirect('profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = user_cache.get_or_404(username)
     follow_to_delete = Follow.objects.filter(user=request.user,
                                              author=author)
     follow_to_delete.delete()
+    timeline.purge(request.user, author)
     return redirect('profile', username=username)
@@ -6,7 +6,7 @@ from django.contrib.auth import get_user_model
 
 def get_field_context(context, field_type):
     for field in context.keys():
-        if field not in ('user', 'request') and type(context[field]) == field_type:
+        if field not in ('user', 'request') and isinstance(context[field], field_type):
             return context[field]
     return
 
@@ -0,0 +1,252 @@
+"""Two level cache backend.
+
+TieredCache keeps a small LRU of recently read values inside each worker
+process (L1) in front of a cache shared by all workers (L2, any Django
+backend configured under its own alias: memcached, redis, file based,
+database...). Reads are served from L1 when possible, writes go through
+to L2.
+
+Filling a key that L2 does not hold yet tells nobody: no process can
+have an older value of it. Overwrites, deletes and incr() bump a
+generation counter stored in L2 and log the changed keys under the new
+generation. Each process looks at that counter at most once per
+SYNC_INTERVAL seconds and drops from its L1 only the keys changed by
+others since, so a value is never served from L1 for longer than
+SYNC_INTERVAL after it was replaced elsewhere (and never longer than
+L1_TIMEOUT at all). A process too far behind, or missing a log entry,
+drops its whole L1. The counter relies on L2 incr(), which is atomic on
+memcached and redis; on the file based backend concurrent bumps may be
+merged, which only costs an extra L1 flush.
+
+Example::
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.cache.TieredCache',
+            'LOCATION': 'shared',
+            'OPTIONS': {'L1_MAX_ENTRIES': 1000, 'L1_TIMEOUT': 5,
+                        'SYNC_INTERVAL': 1},
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        },
+    }
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from yatube import performance
+
+GENERATION_KEY = 'tiered:generation'
+CHANGES_KEY = 'tiered:changes:{generation}'
+# Generations a process may catch up with key by key
+MAX_CHANGES_BEHIND = 100
+CHANGES_TIMEOUT = 60
+
+_missing = object()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self._sync_interval = float(options.get('SYNC_INTERVAL', 1))
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._synced_at = None
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    # L1 bookkeeping
+
+    def _sync(self):
+        """Drop from L1 what other processes have changed since the last
+        check."""
+        now = time.monotonic()
+        if (self._synced_at is not None
+                and now - self._synced_at < self._sync_interval):
+            return
+        # Nothing was ever changed, or the whole L2 was cleared
+        generation = self.shared.get(GENERATION_KEY, 0)
+        changed = self._changes(self._generation, generation)
+        with self._lock:
+            if changed is None:
+                self._local.clear()
+            else:
+                for local_key in changed:
+                    self._local.pop(local_key, None)
+            self._generation = generation
+            self._synced_at = now
+
+    def _changes(self, since, generation):
+        """Keys changed after generation since up to generation, None if
+        they can't be known."""
+        if generation == since:
+            return ()
+        if (since is None or generation < since
+                or generation - since > MAX_CHANGES_BEHIND):
+            return None
+        keys = [CHANGES_KEY.format(generation=number)
+                for number in range(since + 1, generation + 1)]
+        logged = self.shared.get_many(keys)
+        if len(logged) != len(keys):
+            return None
+        return [local_key for local_keys in logged.values()
+                for local_key in local_keys]
+
+    def _bump(self, *local_keys):
+        """Tell the other processes to drop these keys from their L1."""
+        try:
+            generation = self.shared.incr(GENERATION_KEY)
+        except ValueError:
+            generation = 1
+            self.shared.set(GENERATION_KEY, generation, timeout=None)
+        self.shared.set(CHANGES_KEY.format(generation=generation),
+                        local_keys, CHANGES_TIMEOUT)
+        with self._lock:
+            if (self._generation is not None
+                    and generation == self._generation + 1):
+                # Nobody else wrote in between, nothing to catch up with
+                self._generation = generation
+
+    def _remember(self, local_key, value, timeout=DEFAULT_TIMEOUT):
+        ttl = self._l1_timeout
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is not None:
+            ttl = min(ttl, timeout - time.time())
+        if ttl <= 0:
+            self._forget(local_key)
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[local_key] = (data, time.monotonic() + ttl)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._l1_max_entries:
+                self._local.popitem(last=False)
+
+    def _recall(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _missing
+            data, expires = entry
+            if expires <= time.monotonic():
+                del self._local[local_key]
+                return _missing
+            self._local.move_to_end(local_key)
+        return pickle.loads(data)
+
+    def _forget(self, *local_keys):
+        with self._lock:
+            for local_key in local_keys:
+                self._local.pop(local_key, None)
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+        self._sync()
+        value = self._recall(local_key)
+        if value is not _missing:
+            performance.record_cache_lookup(hits=1, misses=0)
+            return value
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            performance.record_cache_lookup(hits=0, misses=1)
+            return default
+        performance.record_cache_lookup(hits=1, misses=0)
+        self._remember(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found = {}
+        misses = []
+        for key in keys:
+            value = self._recall(self.make_key(key, version))
+            if value is _missing:
+                misses.append(key)
+            else:
+                found[key] = value
+        shared = {}
+        if misses:
+            shared = self.shared.get_many(misses, version=version)
+            for key, value in shared.items():
+                self._remember(self.make_key(key, version), value)
+            found.update(shared)
+        performance.record_cache_lookup(
+            hits=len(found), misses=len(misses) - len(shared))
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_key(key, version)
+        if not self.shared.add(key, value, timeout, version=version):
+            # An overwrite, other processes may hold the old value
+            self.shared.set(key, value, timeout, version=version)
+            self._bump(local_key)
+        self._remember(local_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        existing = self.shared.get_many(list(data), version=version)
+        failed = self.shared.set_many(data, timeout, version=version)
+        if existing:
+            self._bump(*(self.make_key(key, version) for key in existing))
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(self.make_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Goes straight to L2: add() is used for locks and must be atomic
+        # across processes
+        return self.shared.add(key, value, timeout, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        local_key = self.make_key(key, version)
+        self.shared.delete(key, version=version)
+        self._bump(local_key)
+        self._forget(local_key)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return
+        local_keys = [self.make_key(key, version) for key in keys]
+        self.shared.delete_many(keys, version=version)
+        self._bump(*local_keys)
+        self._forget(*local_keys)
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self.make_key(key, version)
+        value = self.shared.incr(key, delta, version=version)
+        self._bump(local_key)
+        self._forget(local_key)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        # Drops the generation and its log too, every process flushes
+        self.shared.clear()
+        with self._lock:
+            self._local.clear()
+            self._generation = None
@@ -0,0 +1,260 @@
+"""Per-request performance instrumentation.
+
+PerformanceMiddleware measures every request: wall time, the number and
+total time of SQL queries, template render time and cache hits and
+misses. The numbers are sent back to staff users in a Server-Timing
+header (shown by the browser dev tools), to everyone with
+PERFORMANCE_SERVER_TIMING, added to per view histograms kept in the process
+(see stats, served as JSON by yatube.views.performance_stats) and
+requests slower than PERFORMANCE_SLOW_REQUEST_MS are logged with their
+most expensive queries.
+
+Template time is measured by the TimedTemplates backend, cache lookups
+are reported by yatube.cache.TieredCache.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = None
+        self.queries = 0
+        self.sql_time = 0.0
+        # sql -> [count, total time], to spot repeated queries
+        self.statements = {}
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        statement = self.statements.setdefault(sql, [0, 0.0])
+        statement[0] += 1
+        statement[1] += duration
+
+    def top_queries(self, count):
+        """(sql, executions, total ms) of the most expensive statements."""
+        statements = sorted(self.statements.items(),
+                            key=lambda item: item[1][1], reverse=True)
+        return [(sql, executions, total * 1000)
+                for sql, (executions, total) in statements[:count]]
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def server_timing(self):
+        return ', '.join((
+            f'total;dur={self.duration * 1000:.1f}',
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} '
+            f'queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} '
+            f'misses"',
+        ))
+
+
+def current():
+    """Metrics of the request being handled by this thread, or None."""
+    return getattr(_local, 'metrics', None)
+
+
+def record_cache_lookup(hits, misses):
+    metrics = current()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class ViewStats:
+    """Histogram of the response times of one view."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.requests = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, metrics):
+        duration = metrics.duration * 1000
+        index = 0
+        while index < len(self.buckets) and duration > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.requests += 1
+        self.total_ms += duration
+        self.max_ms = max(self.max_ms, duration)
+        self.queries += metrics.queries
+        self.sql_ms += metrics.sql_time * 1000
+        self.template_ms += metrics.template_time * 1000
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the percentile."""
+        rank = self.requests * percent / 100
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_ms
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'mean_ms': self.total_ms / requests,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'queries_mean': self.queries / requests,
+            'sql_ms_mean': self.sql_ms / requests,
+            'template_ms_mean': self.template_ms / requests,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'histogram': {
+                **{f'<={bound}': count
+                   for bound, count in zip(self.buckets, self.counts)},
+                f'>{self.buckets[-1]}': self.counts[-1],
+            },
+        }
+
+
+class Stats:
+    """Per view statistics of the requests served by this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, view_name, metrics):
+        with self._lock:
+            view = self._views.get(view_name)
+            if view is None:
+                view = self._views[view_name] = ViewStats(
+                    settings.PERFORMANCE_BUCKETS_MS)
+            view.add(metrics)
+
+    def as_dict(self):
+        with self._lock:
+            return {name: view.as_dict()
+                    for name, view in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+stats = Stats()
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(self.time_query))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        metrics.finish()
+
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        stats.add(view_name, metrics)
+        if self.show_timing(request):
+            response['Server-Timing'] = metrics.server_timing()
+        if metrics.duration * 1000 > settings.PERFORMANCE_SLOW_REQUEST_MS:
+            self.log_slow(request, view_name, metrics)
+        return response
+
+    @staticmethod
+    def show_timing(request):
+        if settings.PERFORMANCE_SERVER_TIMING:
+            return True
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    @staticmethod
+    def time_query(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metrics = current()
+            if metrics is not None:
+                metrics.record_query(sql, time.perf_counter() - started)
+
+    @staticmethod
+    def log_slow(request, view_name, metrics):
+        queries = ''.join(
+            f'\n  {executions}x {total:.1f} ms: {sql}'
+            for sql, executions, total
+            in metrics.top_queries(settings.PERFORMANCE_SLOW_TOP_QUERIES))
+        logger.warning(
+            'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, '
+            'templates %.1f ms%s',
+            request.method, request.get_full_path(), view_name,
+            metrics.duration * 1000, metrics.queries,
+            metrics.sql_time * 1000, metrics.template_time * 1000, queries)
+
+
+class TimedTemplate:
+    """Wraps a backend template to add its render time to the request."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = current()
+        if metrics is None:
+            return self.template.render(context, request)
+        # Templates rendered by tags of another template are already
+        # counted in its time
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedTemplates(DjangoTemplates):
+    """The Django template engine, with render times reported."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.performance.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,17 +57,28 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'posts.page_cache.PageHolesMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if not DEBUG:
+    # Keep compiled templates in memory instead of parsing them again on
+    # every render
+    TEMPLATE_LOADERS = [
+        ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+    ]
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'yatube.performance.TimedTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'yatube.context_processors.year',
                 'django.template.context_processors.debug',
@@ -147,7 +160,138 @@ SITE_ID = 3
 # Cache
 
 CACHES = {
+    # A small per-process LRU in front of the cache shared by all workers,
+    # see yatube/cache.py
     'default': {
+        'BACKEND': 'yatube.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'SYNC_INTERVAL': 1,
+        },
+    },
+    # Shared by all worker processes on this host; point this to memcached
+    # or redis to share it between hosts, e.g.
+    # 'django.core.cache.backends.memcached.MemcachedCache'
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+# Tests get a fresh cache in every process instead of files left over by
+# previous runs
+if sys.argv[1:2] == ['test'] or 'pytest' in sys.modules:
+    CACHES['shared'] = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
-}
+
+# Follow feed
+
+# Newest posts kept in each user's materialized follow feed
+TIMELINE_SIZE = 1000
+# Authors with more followers are merged into the feed on read instead of
+# being pushed into every follower's timeline
+TIMELINE_FANOUT_LIMIT = 5000
+TIMELINE_CELEBRITIES_TTL = 60 * 5
+# Lifetime of the per-user follow feed fragments, see posts.feed_cache
+FOLLOW_FEED_CACHE_TIMEOUT = 60 * 10
+# Index pages are rebuilt on changes, the timeout only evicts cold pages
+INDEX_CACHE_TIMEOUT = 60 * 60
+# Rendered post cards, see posts.feed_cache.card_key. A changed post gets
+# a new key, the timeout only evicts the old cards
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Thumbnails
+
+# Thumbnails are made by a thread pool, see posts/thumbnails.py.
+# Set THUMBNAIL_WORKERS = 0 to make them inline, where they are needed
+THUMBNAIL_BACKEND = 'posts.thumbnails.PregeneratingBackend'
+THUMBNAIL_KVSTORE = 'posts.thumbnails.KVStore'
+THUMBNAIL_WORKERS = 2
+# Post images are cropped to POST_IMAGE_ASPECT and stored at every width
+# in every format below, see posts.thumbnails.variants
+POST_IMAGE_ASPECT = (960, 339)
+POST_IMAGE_VARIANT_WIDTHS = (480, 720, 960)
+POST_IMAGE_VARIANT_FORMATS = ('JPEG', 'WEBP')
+
+# Uploaded post images are downsampled to fit POST_IMAGE_MAX_SIZE and
+# re-encoded, see posts/uploads.py. Bigger uploads are refused: JPEGs
+# past POST_IMAGE_MAX_PIXELS, other formats, which are decoded at full
+# size, past POST_IMAGE_MAX_DECODED_PIXELS
+POST_IMAGE_MAX_SIZE = (1920, 1920)
+POST_IMAGE_MAX_PIXELS = 100 * 1000 * 1000
+POST_IMAGE_MAX_DECODED_PIXELS = 12 * 1000 * 1000
+POST_IMAGE_QUALITY = 85
+
+# Performance
+
+# yatube.performance.PerformanceMiddleware times every request. Staff
+# users always get the timings in a Server-Timing header, set to True to
+# send it to everyone
+PERFORMANCE_SERVER_TIMING = False
+# Slower requests are logged with their most expensive queries
+PERFORMANCE_SLOW_REQUEST_MS = 500
+PERFORMANCE_SLOW_TOP_QUERIES = 5
+# Histogram buckets of the per view stats served at /admin/performance/
+PERFORMANCE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Search
+
+# Post and comment text is indexed for /search/ and the admin, see
+# posts/search.py: FTS5 tables on SQLite, GIN indexes on PostgreSQL
+SEARCH_MAX_RESULTS = 1000
+# Weight of a match in a comment relative to one in the post text
+SEARCH_COMMENT_WEIGHT = 0.5
+# Text search configuration of the PostgreSQL indexes. Changing it needs
+# the indexes of migration 0023 to be recreated
+SEARCH_POSTGRES_CONFIG = 'russian'
+
+# Reversed URLs remembered by the post_urls template tags
+POST_URL_CACHE_SIZE = 10000
+
+# Comments
+
+# Comments shown on a post page and loaded by each "more" click
+COMMENTS_PER_PAGE = 50
+
+# API
+
+# Rows per page of the JSON API lists, see posts/api.py
+API_PAGE_SIZE = 20
+
+# Conditional GET
+
+# How long a shared cache (the reverse proxy) may serve the pages of
+# anonymous users before revalidating them, see posts/conditional.py
+PAGE_SHARED_MAX_AGE = 60
+
+# Feed totals
+
+# Kept in the cache and moved by signals, see posts/feed_counts.py
+FEED_COUNT_TIMEOUT = 60 * 60 * 24
+# Take the total of the index from the database statistics instead of
+# COUNT(*), for very large tables
+FEED_COUNT_ESTIMATE = False
+
+# Object cache
+
+# Users, groups and posts looked up by the views, see posts/cache.py
+OBJECT_CACHE_TIMEOUT = 60 * 60
+# Lookups that found nothing
+OBJECT_CACHE_MISSING_TIMEOUT = 60
+
+# Page cache
+
+# Shells of the post pages, keyed by their validators, see
+# posts/page_cache.py
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Admin
+
+# Changelist totals above this are estimated, see
+# posts.paginator.EstimatedCountPaginator
+ADMIN_EXACT_COUNT_LIMIT = 10000
@@ -0,0 +1,170 @@
+import subprocess
+import sys
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from yatube import performance
+from yatube.cache import TieredCache
+
+
+class TestTieredCache(SimpleTestCase):
+    """Test for the L1 + shared L2 cache backend"""
+
+    def setUp(self):
+        self.shared_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.'
+                           'FileBasedCache',
+                'LOCATION': self.shared_dir.name,
+            },
+        })
+        self.settings.enable()
+        params = {'OPTIONS': {'L1_TIMEOUT': 60, 'SYNC_INTERVAL': 0}}
+        # Two "processes" sharing one file based L2
+        self.worker_1 = TieredCache('shared', params)
+        self.worker_2 = TieredCache('shared', params)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.shared_dir.cleanup()
+
+    def test_read_through(self):
+        self.worker_1.set('key', 'value')
+        self.assertEqual(self.worker_2.get('key'), 'value')
+        self.assertEqual(caches['shared'].get('key'), 'value')
+
+    def test_reads_served_from_l1(self):
+        self.worker_1.set('key', 'value')
+        self.worker_1.get('key')
+        # Changed behind the backend's back, L1 still answers
+        caches['shared'].set('key', 'changed')
+        self.assertEqual(self.worker_1.get('key'), 'value')
+
+    def test_cross_process_invalidation(self):
+        self.worker_1.set('key', 'value')
+        self.assertEqual(self.worker_2.get('key'), 'value')
+        self.worker_1.set('key', 'new value')
+        self.assertEqual(self.worker_2.get('key'), 'new value')
+        self.worker_1.delete('key')
+        self.assertIsNone(self.worker_2.get('key'))
+
+    def test_only_changed_keys_dropped(self):
+        self.worker_1.set('a', 'a')
+        self.worker_1.set('b', 'b')
+        self.worker_2.get('a')
+        self.worker_2.get('b')
+        # Behind the backend's back, to see what worker_2 reads from L1
+        caches['shared'].set('a', 'stale')
+        caches['shared'].set('b', 'stale')
+        # New keys filled elsewhere flush nothing
+        self.worker_1.set('c', 'c')
+        self.worker_1.set_many({'d': 'd'})
+        self.assertEqual(self.worker_2.get('a'), 'a')
+        # An overwrite drops that key only
+        self.worker_1.set('b', 'new b')
+        self.assertEqual(self.worker_2.get('b'), 'new b')
+        self.assertEqual(self.worker_2.get('a'), 'a')
+
+    def test_far_behind_drops_l1(self):
+        self.worker_1.set('key', 'value')
+        self.worker_2.get('key')
+        caches['shared'].set('key', 'stale')
+        self.worker_1.delete('other')
+        self.worker_1.delete('other')
+        # Generation 1's log is lost, worker_2 can't tell what changed
+        caches['shared'].delete('tiered:changes:1')
+        self.assertEqual(self.worker_2.get('key'), 'stale')
+
+    def test_lru_cap(self):
+        cache = TieredCache('shared', {'OPTIONS': {'L1_MAX_ENTRIES': 2}})
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        self.assertEqual(list(cache._local), [cache.make_key('b'),
+                                              cache.make_key('c')])
+
+    def test_add_is_shared(self):
+        self.assertTrue(self.worker_1.add('lock', 1))
+        self.assertFalse(self.worker_2.add('lock', 1))
+
+    def test_default_l2_shared_between_processes(self):
+        # Outside of tests the settings must not fall back to a per process
+        # L2
+        backend = subprocess.run(
+            [sys.executable, '-c', 'from yatube import settings; '
+             'print(settings.CACHES["shared"]["BACKEND"])'],
+            stdout=subprocess.PIPE, check=True, universal_newlines=True,
+        ).stdout.strip()
+        self.assertEqual(
+            backend, 'django.core.cache.backends.filebased.FileBasedCache')
+
+
+class TestPerformanceMiddleware(TestCase):
+    """Test for the request timing middleware and its stats endpoint"""
+
+    def setUp(self):
+        # Pages cached by other tests are served without a query
+        caches['default'].clear()
+        performance.stats.reset()
+        self.user = get_user_model().objects.create_user(
+            username='testuser', password=12345)
+
+    def test_server_timing(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index'))
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'tpl;dur=', 'cache;desc='):
+            self.assertIn(metric, timing)
+
+    def test_no_server_timing_for_public(self):
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(PERFORMANCE_SERVER_TIMING=True)
+    def test_server_timing_for_everyone(self):
+        response = self.client.get(reverse('index'))
+        self.assertTrue(response.has_header('Server-Timing'))
+
+    def test_cache_lookups_counted(self):
+        metrics = performance._local.metrics = performance.RequestMetrics()
+        try:
+            cache = TieredCache('shared', {})
+            cache.set('key', 'value')
+            cache.get('key')
+            cache.get_many(['key', 'other'])
+        finally:
+            performance._local.metrics = None
+        self.assertEqual((metrics.cache_hits, metrics.cache_misses), (2, 1))
+
+    def test_stats_endpoint(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        url = reverse('performance_stats')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.user.is_staff = True
+        self.user.save()
+        index = self.client.get(url).json()['index']
+        self.assertEqual(index['requests'], 2)
+        self.assertGreater(index['queries_mean'], 0)
+        self.assertEqual(sum(index['histogram'].values()), 2)
+
+    @override_settings(PERFORMANCE_SLOW_REQUEST_MS=0)
+    def test_slow_request_logged(self):
+        with self.assertLogs('yatube.performance', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        self.assertIn('Slow request GET / (index)', logs.output[0])
+        self.assertIn('FROM "posts_post"', logs.output[0])
@@ -4,10 +4,13 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import include, path
 
+from yatube.views import performance_stats
+
 handler404 = 'posts.views.page_not_found'
 handler500 = 'posts.views.server_error'
 
 urlpatterns = [
+    path('admin/performance/', performance_stats, name='performance_stats'),
     path("admin/", admin.site.urls),
     path('about/', include('django.contrib.flatpages.urls')),
     path("auth/", include("users.urls")),
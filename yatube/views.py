@@ -0,0 +1,12 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from yatube.performance import stats
+
+
+@staff_member_required
+def performance_stats(request):
+    """Response time histograms per view, for this process only."""
+    if request.method == 'POST':
+        stats.reset()
+    return JsonResponse(stats.as_dict())